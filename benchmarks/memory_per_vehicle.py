@@ -0,0 +1,56 @@
+"""Measures the memory used per vehicle by the simulator objects.
+
+Builds the generated road map and a large vehicle network (the routes
+of a vehicles file repeated), and reports the bytes allocated per
+vehicle as measured by tracemalloc.
+
+Run from the repository root:
+
+    python -m benchmarks.memory_per_vehicle [num_vehicles]
+"""
+
+__author__ = 'Adam Morrissett', 'Steven M. Hernandez'
+
+
+import csv
+import sys
+import tracemalloc
+
+from vanet_sim import road_net, vehicle_net
+
+
+def measure(num_vehicles, intersection_file='intersections.generated.csv',
+            road_file='roads.generated.csv',
+            vehicle_file='vehicles.200.generated.csv'):
+    """Measures the bytes allocated per vehicle.
+
+    :param num_vehicles: number of vehicles to build
+    :param intersection_file: path to the intersections file
+    :param road_file: path to the roads file
+    :param vehicle_file: path to a vehicles file whose routes are reused
+    :return: bytes per vehicle
+    """
+
+    road_map = road_net.RoadMap(intersection_file=intersection_file,
+                                road_file=road_file)
+
+    with open(file=vehicle_file, mode='r', newline='') as fp:
+        routes = [row[1].split(',') for row in csv.reader(fp, delimiter=';')]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    vehicles = []
+    for i in range(num_vehicles):
+        route = [road_map.road_dict[r] for r in routes[i % len(routes)]]
+        vehicles.append(vehicle_net.Vehicle(node_id=i + 1, route=route))
+
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return (after - before) / num_vehicles
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    print(f'{n} vehicles: {measure(n):.0f} bytes per vehicle')
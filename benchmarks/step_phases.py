@@ -0,0 +1,232 @@
+"""Measures how each phase of Simulation.step scales with the network size.
+
+For every number of vehicles, builds a grid map and a vehicle network
+with the generators of create_random_roads_and_vehicles.py (the grid
+grows with the number of vehicles so that traffic density stays about
+the same as in the generated 8x8 map with 200 vehicles), then times
+each phase of Simulation.step (see simulation.STEP_PHASES) for every
+engine and routing protocol.
+
+Nothing is routed before the first vehicle is affected by the incident,
+so by default each run is stepped untimed until then, and the rest of a
+RUN_TIME run (as in main.py) is timed. The timed steps then include the
+routing and forwarding of the whole message dissemination, which is
+where the protocols differ.
+
+Run from the repository root:
+
+    python -m benchmarks.step_phases --vehicles 100 1000 10000 100000
+
+Results are written to a CSV file with one row per run and phase, and
+optionally plotted as scaling curves (needs matplotlib).
+"""
+
+__author__ = 'Adam Morrissett', 'Steven M. Hernandez'
+
+
+import argparse
+import contextlib
+import csv
+import io
+import math
+import os
+import random
+import tempfile
+import time
+
+import create_random_roads_and_vehicles as generator
+from vanet_sim import road_net, simulation, vehicle_net
+
+RESULTS_CSV_HEADER = ["engine", "protocol", "num_vehicles", "num_intersections", "num_steps", "phase",
+                      "total_seconds", "seconds_per_step", "start_time"]
+
+# Vehicles per intersection of the generated map (200 on 8x8)
+VEHICLES_PER_INTERSECTION = 200 / 64
+
+# Simulation time of a run, as in main.py
+RUN_TIME = 100
+
+
+def grid_size(num_vehicles):
+    """Gets the number of intersections along each side of the grid.
+
+    :param num_vehicles: number of vehicles on the map
+    :return: even number of intersections, at least the generated 8
+    """
+
+    size = math.ceil(math.sqrt(num_vehicles / VEHICLES_PER_INTERSECTION))
+    return max(generator.NUM_INTERSECTIONS_X, size + size % 2)
+
+
+def build_network(num_vehicles, directory, seed=0):
+    """Generates the map and vehicle files of a benchmark network.
+
+    :param num_vehicles: number of vehicles
+    :param directory: directory to write the files to
+    :param seed: random seed of the generators
+    :return: tuple of file paths (intersections, roads, vehicles)
+    """
+
+    size = grid_size(num_vehicles)
+    files = tuple(os.path.join(directory, f) for f in
+                  ("intersections.csv", "roads.csv", "vehicles.csv"))
+
+    random.seed(seed)
+    generator.write_intersections(files[0], size, size)
+    generator.write_roads(files[1], size, size)
+    generator.write_vehicles(files[2], num_vehicles, size, size)
+
+    return files
+
+
+def time_phases(files, engine, protocol, num_steps=None, warmup_steps=None, d_time=0.5, storage=None):
+    """Times each phase of a number of simulation steps.
+
+    :param files: tuple of file paths as built by build_network
+    :param engine: simulation engine (see Simulation)
+    :param protocol: routing protocol type (see ROUTING_PROTOCOLS)
+    :param num_steps: number of timed steps (default: until RUN_TIME)
+    :param warmup_steps: number of untimed steps run first (default:
+        until the first vehicle is affected, or RUN_TIME)
+    :param d_time: simulation time resolution
+    :param storage: directory to log the experiment to
+    :return: tuple of (dict of phase name to total seconds, simulation
+        time of the first timed step, number of timed steps)
+    """
+
+    road_map = road_net.RoadMap(intersection_file=files[0], road_file=files[1])
+    vehicles = vehicle_net.build_vehicle_net(filepath=files[2], road_map=road_map)
+
+    totals = {name: 0.0 for name in simulation.STEP_PHASES}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        sim = simulation.Simulation(d_time=d_time, road_map=road_map, vehicle_net=vehicles, engine=engine,
+                                    settings={"protocol": {"type": protocol}}, experiment_storage=storage)
+        sim.report = simulation.REPORT_FINAL_STRING
+
+        try:
+            if warmup_steps is None:
+                while not sim.metrics.num_affected and sim.cur_time < RUN_TIME:
+                    sim.step()
+            else:
+                for _ in range(warmup_steps):
+                    sim.step()
+
+            start_time = sim.cur_time
+            start_step = sim.num_steps
+            phases = sim.phases()
+
+            while (sim.cur_time < RUN_TIME if num_steps is None
+                   else sim.num_steps - start_step < num_steps):
+                for name, phase in phases:
+                    start = time.perf_counter()
+                    phase()
+                    totals[name] += time.perf_counter() - start
+
+                sim.advance_time()
+        finally:
+            sim.close()
+
+    return totals, start_time, sim.num_steps - start_step
+
+
+def run_benchmarks(vehicle_counts, engines, protocols, num_steps=None, warmup_steps=None, seed=0):
+    """Times the step phases of every combination of size, engine and protocol.
+
+    :param vehicle_counts: List of numbers of vehicles
+    :param engines: List of simulation engines
+    :param protocols: List of routing protocol types
+    :param num_steps: number of timed steps per run (default: until
+        RUN_TIME, see time_phases)
+    :param warmup_steps: number of untimed steps per run (default:
+        until the first vehicle is affected, see time_phases)
+    :param seed: random seed of the generators
+    :return: List of result rows (see RESULTS_CSV_HEADER)
+    """
+
+    rows = []
+
+    for num_vehicles in vehicle_counts:
+        with tempfile.TemporaryDirectory() as directory:
+            files = build_network(num_vehicles, directory, seed)
+
+            for engine in engines:
+                for protocol in protocols:
+                    totals, start_time, timed_steps = time_phases(
+                        files, engine, protocol, num_steps, warmup_steps,
+                        storage=os.path.join(directory, "{}-{}".format(engine, protocol)))
+
+                    for name in simulation.STEP_PHASES:
+                        rows.append([engine, protocol, num_vehicles, grid_size(num_vehicles) ** 2, timed_steps,
+                                     name, totals[name], totals[name] / timed_steps, start_time])
+
+                    print("{} vehicles, {} engine, {}, {} steps from t = {:.1f}: {:.3f} ms/step ({})".format(
+                        num_vehicles, engine, protocol, timed_steps, start_time,
+                        1000 * sum(totals.values()) / timed_steps,
+                        ", ".join("{} {:.3f}".format(name, 1000 * totals[name] / timed_steps)
+                                  for name in simulation.STEP_PHASES)))
+
+    return rows
+
+
+def write_results(filepath, rows):
+    with open(filepath, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(RESULTS_CSV_HEADER)
+        writer.writerows(rows)
+
+
+def plot_results(filepath, rows):
+    """Plots seconds per step against the number of vehicles for each phase.
+
+    :param filepath: path to the image file
+    :param rows: List of result rows (see RESULTS_CSV_HEADER)
+    :return: None
+    """
+
+    # Imported here so matplotlib is only needed to plot
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    runs = sorted({(r[0], r[1]) for r in rows})
+    fig, axes = plt.subplots(1, len(runs), figsize=(5 * len(runs), 4), squeeze=False, sharey=True)
+
+    for ax, (engine, protocol) in zip(axes[0], runs):
+        for name in simulation.STEP_PHASES:
+            points = sorted((r[2], r[7]) for r in rows if r[0] == engine and r[1] == protocol and r[5] == name)
+            ax.plot([p[0] for p in points], [p[1] for p in points], marker="o", label=name)
+
+        ax.set_xscale("log")
+        ax.set_yscale("log")
+        ax.set_title("{} ({})".format(protocol, engine))
+        ax.set_xlabel("# vehicles")
+
+    axes[0][0].set_ylabel("seconds per step")
+    axes[0][0].legend()
+    fig.tight_layout()
+    fig.savefig(filepath)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Times each phase of Simulation.step.")
+    parser.add_argument("--vehicles", type=int, nargs="+", default=[100, 1000, 10000, 100000],
+                        help="numbers of vehicles to benchmark")
+    parser.add_argument("--engines", nargs="+",
+                        default=[simulation.OBJECT_ENGINE_STRING, simulation.VECTORIZED_ENGINE_STRING])
+    parser.add_argument("--protocols", nargs="+", default=list(simulation.ROUTING_PROTOCOLS))
+    parser.add_argument("--steps", type=int, default=None,
+                        help="number of timed steps per run (default: until t = {})".format(RUN_TIME))
+    parser.add_argument("--warmup-steps", type=int, default=None,
+                        help="number of untimed steps run first (default: until the first vehicle is affected)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed of the generators")
+    parser.add_argument("--output", default="step_phases.csv", help="path to the results file")
+    parser.add_argument("--plot", default=None, help="path to an image of the scaling curves")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.vehicles, args.engines, args.protocols, args.steps, args.warmup_steps, args.seed)
+
+    write_results(args.output, results)
+
+    if args.plot is not None:
+        plot_results(args.plot, results)
@@ -0,0 +1,517 @@
+"""Create synthetic SUMO runs for scale testing, without running SUMO.
+
+Writes a grid network, random vehicle routes and the fcd, bt and vehroute
+outputs sumo_sim reads, in the same layout as the sumo/ and storage/sumo/
+directories of this repository:
+
+    python -m sumo_sim.create_synthetic_trace --vehicles 5000 --duration 3600
+
+Vehicles drive their routes at the speed limit. From the incident time,
+vehicles reaching the middle of the incident edge stop there and queue up
+behind each other, so they never arrive (like the vehicles SUMO vaporizes
+in our runs). Outputs are written one timestep at a time, and a vehicle's
+bt and vehroute entries are written soon after it leaves the network, so
+memory use depends on the number of vehicles on the network, not on the
+duration of the run.
+"""
+
+__author__ = 'Steven M. Hernandez'
+
+import argparse
+import os
+
+import numpy as np
+
+from sumo_sim.traces import SUMOCFG_FILE, NET_FILE, ROUTE_FILE, BT_OUTPUT_FILE, VEHROUTE_OUTPUT_FILE, \
+    FCD_OUTPUT_FILE
+
+ADDITIONAL_FILE = "grid.additional.xml"
+
+SPEED_LIMIT = 13.89
+# Distance between the fronts of two queued vehicles
+QUEUE_SPACING = 7.5
+# Number of vehicles that leave the network before their bt entries are written
+BT_BATCH_SIZE = 1000
+
+
+def column_name(k):
+    """Names a grid column like netgenerate does (A, B, ..., Z, AA, AB, ...).
+
+    :param k: index of the column
+    :return: name of the column
+    """
+
+    name = ""
+    k += 1
+    while k:
+        k, r = divmod(k - 1, 26)
+        name = chr(ord("A") + r) + name
+    return name
+
+
+def build_grid(grid_size, spacing):
+    """Builds a square grid network with roads both ways between neighbors.
+
+    :param grid_size: number of junctions along each side
+    :param spacing: distance between neighboring junctions
+    :return: tuple of
+        - dict of junction id to (x, y)
+        - List of (edge id, from junction id, to junction id)
+    """
+
+    junctions = {}
+    for c in range(grid_size):
+        for r in range(grid_size):
+            junctions[column_name(c) + str(r)] = (c * spacing, r * spacing)
+
+    edges = []
+    for c in range(grid_size):
+        for r in range(grid_size):
+            here = column_name(c) + str(r)
+            for d_c, d_r in ((0, 1), (1, 0), (0, -1), (-1, 0)):
+                if 0 <= c + d_c < grid_size and 0 <= r + d_r < grid_size:
+                    there = column_name(c + d_c) + str(r + d_r)
+                    edges.append((here + there, here, there))
+
+    return junctions, edges
+
+
+def random_routes(rng, edges, num_vehicles, route_length):
+    """Creates random routes that never turn back on the road they came from.
+
+    :param rng: numpy random Generator
+    :param edges: List of (edge id, from, to) as built by build_grid
+    :param num_vehicles: number of routes to create
+    :param route_length: number of edges per route
+    :return: List of Lists of edge indices
+    """
+
+    leaving = {}
+    for k, (_, j_from, _) in enumerate(edges):
+        leaving.setdefault(j_from, []).append(k)
+
+    routes = []
+    for first in rng.integers(len(edges), size=num_vehicles).tolist():
+        route = [first]
+        while len(route) < route_length:
+            _, j_from, j_to = edges[route[-1]]
+            choices = [k for k in leaving[j_to] if edges[k][2] != j_from]
+            route.append(choices[rng.integers(len(choices))])
+        routes.append(route)
+
+    return routes
+
+
+def write_network(filepath, junctions, edges):
+    """Writes a net.xml file of the grid.
+
+    :param filepath: path to the net.xml file
+    :param junctions: dict of junction id to (x, y)
+    :param edges: List of (edge id, from, to)
+    :return: None
+    """
+
+    incoming = {j: [] for j in junctions}
+    for edge_id, _, j_to in edges:
+        incoming[j_to].append(edge_id + "_0")
+
+    xs = [x for x, _ in junctions.values()]
+    ys = [y for _, y in junctions.values()]
+    boundary = "{:.2f},{:.2f},{:.2f},{:.2f}".format(min(xs), min(ys), max(xs), max(ys))
+
+    with open(filepath, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n')
+        f.write('<net version="1.1">\n\n')
+        f.write('    <location netOffset="0.00,0.00" convBoundary="{0}" origBoundary="{0}" projParameter="!"/>\n\n'
+                .format(boundary))
+
+        for edge_id, j_from, j_to in edges:
+            (x_0, y_0), (x_1, y_1) = junctions[j_from], junctions[j_to]
+            f.write('    <edge id="{}" from="{}" to="{}" priority="-1">\n'.format(edge_id, j_from, j_to))
+            f.write('        <lane id="{}_0" index="0" speed="{:.2f}" length="{:.2f}" '
+                    'shape="{:.2f},{:.2f} {:.2f},{:.2f}"/>\n'
+                    .format(edge_id, SPEED_LIMIT, np.hypot(x_1 - x_0, y_1 - y_0), x_0, y_0, x_1, y_1))
+            f.write('    </edge>\n')
+        f.write('\n')
+
+        for j, (x, y) in junctions.items():
+            f.write('    <junction id="{}" type="priority" x="{:.2f}" y="{:.2f}" incLanes="{}" intLanes="" '
+                    'shape="{:.2f},{:.2f} {:.2f},{:.2f} {:.2f},{:.2f} {:.2f},{:.2f}"/>\n'
+                    .format(j, x, y, " ".join(incoming[j]),
+                            x - 3.2, y + 3.2, x + 3.2, y + 3.2, x + 3.2, y - 3.2, x - 3.2, y - 3.2))
+
+        f.write('\n</net>\n')
+
+
+def write_routes(filepath, departs, routes, edges):
+    """Writes a rou.xml file with one vehicle per route.
+
+    :param filepath: path to the rou.xml file
+    :param departs: List of departure times, sorted
+    :param routes: List of Lists of edge indices
+    :param edges: List of (edge id, from, to)
+    :return: None
+    """
+
+    with open(filepath, "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<routes>\n')
+        for v, (depart, route) in enumerate(zip(departs, routes)):
+            f.write('    <vehicle id="{}" depart="{:.2f}">\n'.format(v, depart))
+            f.write('        <route edges="{}"/>\n'.format(" ".join(edges[e][0] for e in route)))
+            f.write('    </vehicle>\n')
+        f.write('</routes>\n')
+
+
+def write_config(sumo_dir, begin, end, bt_range, incident_edge, incident_time):
+    """Writes the sumocfg and additional files matching the other files.
+
+    :param sumo_dir: directory of the SUMO configuration files
+    :param begin: first time of the run
+    :param end: time at which the run ends
+    :param bt_range: range of the bluetooth devices
+    :param incident_edge: id of the incident edge
+    :param incident_time: time at which the incident edge is closed
+    :return: None
+    """
+
+    with open(os.path.join(sumo_dir, ADDITIONAL_FILE), "w") as f:
+        f.write('<additional>\n')
+        f.write('    <variableSpeedSign id="incident_road" lanes="{}_0">\n'.format(incident_edge))
+        f.write('        <step time="{}" speed="0"/>\n'.format(incident_time))
+        f.write('    </variableSpeedSign>\n')
+        f.write('</additional>\n')
+
+    with open(os.path.join(sumo_dir, SUMOCFG_FILE), "w") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<configuration>\n\n')
+        f.write('    <input>\n')
+        f.write('        <net-file value="{}"/>\n'.format(NET_FILE))
+        f.write('        <route-files value="{}"/>\n'.format(ROUTE_FILE))
+        f.write('        <additional-files value="{}"/>\n'.format(ADDITIONAL_FILE))
+        f.write('    </input>\n\n')
+        f.write('    <output>\n')
+        f.write('        <fcd-output value="../storage/sumo/{}"/>\n'.format(FCD_OUTPUT_FILE))
+        f.write('        <vehroute-output value="../storage/sumo/{}"/>\n'.format(VEHROUTE_OUTPUT_FILE))
+        f.write('        <vehroute-output.exit-times value="true"/>\n')
+        f.write('        <vehroute-output.write-unfinished value="true"/>\n')
+        f.write('        <bt-output value="../storage/sumo/{}"/>\n'.format(BT_OUTPUT_FILE))
+        f.write('    </output>\n\n')
+        f.write('    <time>\n')
+        f.write('        <begin value="{}"/>\n'.format(begin))
+        f.write('        <end value="{}"/>\n'.format(end))
+        f.write('    </time>\n\n')
+        f.write('    <communication>\n')
+        f.write('        <device.btreceiver.probability value="1"/>\n')
+        f.write('        <device.btsender.probability value="1"/>\n')
+        f.write('        <device.btreceiver.range value="{}"/>\n'.format(bt_range))
+        f.write('    </communication>\n\n')
+        f.write('</configuration>\n')
+
+
+def pairs_within(x, y, radius):
+    """Finds every ordered pair of points closer than a radius.
+
+    Points are bucketed into square cells of one radius, and each point is
+    only compared to the points of the nine cells around it.
+
+    :param x: array of x coordinates
+    :param y: array of y coordinates
+    :param radius: distance below which two points are a pair
+    :return: tuple of arrays (i, j) of the indices of the pairs
+    """
+
+    if len(x) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+
+    c_x = np.floor(x / radius).astype(np.int64)
+    c_y = np.floor(y / radius).astype(np.int64)
+    c_y -= c_y.min() - 1
+    width = c_y.max() + 2
+    key = c_x * width + c_y
+
+    order = np.argsort(key, kind="stable")
+    sorted_key = key[order]
+
+    found_i = []
+    found_j = []
+
+    for d_x in (-1, 0, 1):
+        for d_y in (-1, 0, 1):
+            target = key + d_x * width + d_y
+            lo = np.searchsorted(sorted_key, target, side="left")
+            counts = np.searchsorted(sorted_key, target, side="right") - lo
+
+            # Expand each point into the range of points of the cell
+            i = np.repeat(np.arange(len(x)), counts)
+            j = order[np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                      + np.repeat(lo, counts)]
+
+            close = (i != j) & (np.hypot(x[i] - x[j], y[i] - y[j]) < radius)
+            found_i.append(i[close])
+            found_j.append(j[close])
+
+    return np.concatenate(found_i), np.concatenate(found_j)
+
+
+def simulate(storage_dir, junctions, edges, departs, routes, begin, end, bt_range, incident_edge, incident_time):
+    """Moves the vehicles along their routes and writes the SUMO outputs.
+
+    :param storage_dir: directory of the SUMO output files
+    :param junctions: dict of junction id to (x, y)
+    :param edges: List of (edge id, from, to)
+    :param departs: List of departure times, sorted
+    :param routes: List of Lists of edge indices, all of the same length
+    :param begin: first time of the run
+    :param end: time at which the run ends
+    :param bt_range: range of the bluetooth devices
+    :param incident_edge: index of the incident edge
+    :param incident_time: time from which vehicles stop on the incident edge
+    :return: None
+    """
+
+    num_vehicles = len(routes)
+    route_length = len(routes[0]) if routes else 0
+
+    edge_ids = [e[0] for e in edges]
+    edge_x = np.array([[junctions[f][0], junctions[t][0]] for _, f, t in edges])
+    edge_y = np.array([[junctions[f][1], junctions[t][1]] for _, f, t in edges])
+    edge_length = np.hypot(edge_x[:, 1] - edge_x[:, 0], edge_y[:, 1] - edge_y[:, 0])
+
+    route_edges = np.array(routes, dtype=np.int64).reshape(num_vehicles, route_length)
+    departs = np.asarray(departs, dtype=float)
+    exit_times = np.full((num_vehicles, route_length), np.nan)
+
+    # Index in its route of the edge each vehicle is on, and how far along
+    # that edge it is
+    route_index = np.zeros(num_vehicles, dtype=np.int64)
+    pos = np.zeros(num_vehicles)
+    departed = np.zeros(num_vehicles, dtype=bool)
+    arrived = np.zeros(num_vehicles, dtype=bool)
+    stopped = np.zeros(num_vehicles, dtype=bool)
+    # Where the next vehicle reaching the incident queue stops
+    queue_end = edge_length[incident_edge] / 2
+
+    # Pairs (i * num_vehicles + j, sorted) of vehicles that currently see
+    # each other and since when, and the closed sightings of the vehicles
+    # whose bt entry is not written yet, as chunks of (i, j, tBeg, tEnd)
+    pairs = np.zeros(0, dtype=np.int64)
+    pairs_since = np.zeros(0)
+    closed = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros(0))]
+    leaving = []
+
+    fcd = open(os.path.join(storage_dir, FCD_OUTPUT_FILE), "w")
+    bt = open(os.path.join(storage_dir, BT_OUTPUT_FILE), "w")
+    vehroute = open(os.path.join(storage_dir, VEHROUTE_OUTPUT_FILE), "w")
+
+    fcd.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<fcd-export>\n')
+    bt.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<bt-output>\n')
+    vehroute.write('<?xml version="1.0" encoding="UTF-8"?>\n\n<routes>\n')
+
+    def close_pairs(ended, t):
+        closed.append((pairs[ended] // num_vehicles, pairs[ended] % num_vehicles, pairs_since[ended],
+                       np.full(ended.sum(), float(t))))
+
+    def write_bt(vehicles):
+        # Take the sightings of the leaving vehicles out of the closed ones
+        is_leaving = np.zeros(num_vehicles, dtype=bool)
+        is_leaving[vehicles] = True
+        i, j, t_beg, t_end = (np.concatenate(c) for c in zip(*closed))
+        keep = ~is_leaving[i]
+        closed[:] = [(i[keep], j[keep], t_beg[keep], t_end[keep])]
+
+        order = np.lexsort((t_beg, i))
+        order = order[is_leaving[i[order]]]
+        i, j, t_beg, t_end = i[order], j[order], t_beg[order], t_end[order]
+
+        for v, a, b in zip(vehicles, np.searchsorted(i, vehicles, side="left").tolist(),
+                           np.searchsorted(i, vehicles, side="right").tolist()):
+            bt.write('    <bt id="{}">\n'.format(v))
+            bt.write("".join('        <seen id="{}" tBeg="{:.2f}" tEnd="{:.2f}"/>\n'.format(*x)
+                             for x in zip(j[a:b].tolist(), t_beg[a:b].tolist(), t_end[a:b].tolist())))
+            bt.write('    </bt>\n')
+
+    def write_vehroute(vehicles, t, has_arrived):
+        for v in vehicles:
+            vehroute.write('    <vehicle id="{}" depart="{:.2f}"{}>\n'.format(
+                v, departs[v], ' arrival="{:.2f}"'.format(t) if has_arrived else ""))
+            vehroute.write('        <route edges="{}" exitTimes="{}"/>\n'.format(
+                " ".join(edge_ids[e] for e in route_edges[v].tolist()),
+                " ".join("{:.2f}".format(x) for x in exit_times[v].tolist() if x == x)))
+            vehroute.write('    </vehicle>\n')
+
+    for t in range(begin, end):
+        # Insert the vehicles departing now at the start of their route
+        new = np.flatnonzero(~departed & (departs <= t))
+        departed[new] = True
+        is_new = np.zeros(num_vehicles, dtype=bool)
+        is_new[new] = True
+
+        on_network = np.flatnonzero(departed & ~arrived)
+        moving = on_network[~stopped[on_network] & ~is_new[on_network]]
+
+        cur_edge = route_edges[moving, route_index[moving]]
+        pos[moving] += SPEED_LIMIT
+
+        # Vehicles reaching the incident queue stop at its end, first come
+        # first served
+        if t >= incident_time:
+            reaching = moving[(cur_edge == incident_edge) & (pos[moving] >= queue_end)]
+            for v in reaching[np.argsort(-pos[reaching], kind="stable")].tolist():
+                pos[v] = queue_end
+                stopped[v] = True
+                queue_end = max(0.0, queue_end - QUEUE_SPACING)
+
+        # Vehicles passing the end of their edge move on to the next one
+        passing = moving[~stopped[moving] & (pos[moving] >= edge_length[cur_edge])]
+        pos[passing] -= edge_length[route_edges[passing, route_index[passing]]]
+        exit_times[passing, route_index[passing]] = t
+        route_index[passing] += 1
+
+        done = passing[route_index[passing] >= route_length]
+        arrived[done] = True
+        route_index[done] = route_length - 1
+
+        present = on_network[~arrived[on_network]]
+        cur_edge = route_edges[present, route_index[present]]
+        f = np.minimum(pos[present] / edge_length[cur_edge], 1)
+        x = edge_x[cur_edge, 0] + (edge_x[cur_edge, 1] - edge_x[cur_edge, 0]) * f
+        y = edge_y[cur_edge, 0] + (edge_y[cur_edge, 1] - edge_y[cur_edge, 0]) * f
+        speed = np.where(stopped[present] | is_new[present], 0.0, SPEED_LIMIT)
+
+        fcd.write('    <timestep time="{:.2f}">\n'.format(t))
+        fcd.write("".join(
+            '        <vehicle id="{}" x="{:.2f}" y="{:.2f}" angle="0.00" type="DEFAULT_VEHTYPE" speed="{:.2f}" '
+            'pos="{:.2f}" lane="{}_0" slope="0.00"/>\n'.format(v, vx, vy, s, p, edge_ids[e])
+            for v, vx, vy, s, p, e in zip(present.tolist(), x.tolist(), y.tolist(), speed.tolist(),
+                                          pos[present].tolist(), cur_edge.tolist())))
+        fcd.write('    </timestep>\n')
+
+        # Open and close sightings as pairs come into and out of range.
+        # Every pair is found once, so the codes need no deduplication
+        i, j = pairs_within(x, y, bt_range)
+        cur_pairs = np.sort(present[i] * num_vehicles + present[j])
+
+        k = np.minimum(np.searchsorted(pairs, cur_pairs), max(len(pairs) - 1, 0))
+        continued = pairs[k] == cur_pairs if len(pairs) else np.zeros(len(cur_pairs), dtype=bool)
+        cur_since = np.where(continued, pairs_since[k] if len(pairs) else 0.0, float(t))
+
+        k = np.minimum(np.searchsorted(cur_pairs, pairs), max(len(cur_pairs) - 1, 0))
+        close_pairs(cur_pairs[k] != pairs if len(cur_pairs) else np.ones(len(pairs), dtype=bool), t)
+
+        pairs, pairs_since = cur_pairs, cur_since
+
+        write_vehroute(done.tolist(), t, True)
+
+        # The bt entries of the vehicles that left are written in batches,
+        # since taking them out of the closed sightings scans all of them
+        leaving.extend(done.tolist())
+        if len(leaving) >= BT_BATCH_SIZE:
+            write_bt(sorted(leaving))
+            leaving = []
+
+    close_pairs(np.ones(len(pairs), dtype=bool), end)
+
+    unfinished = np.flatnonzero(departed & ~arrived).tolist()
+    write_vehroute(unfinished, end, False)
+    write_bt(sorted(leaving + unfinished))
+
+    fcd.write('</fcd-export>\n')
+    bt.write('</bt-output>\n')
+    vehroute.write('</routes>\n')
+
+    for f in (fcd, bt, vehroute):
+        f.close()
+
+
+def create_trace(output_dir, grid_size=8, spacing=100, num_vehicles=200, route_length=10, begin=0, duration=500,
+                 depart_window=None, bt_range=45, incident_edge=None, incident_time=None, seed=None):
+    """Creates a synthetic SUMO run in output_dir/sumo and output_dir/storage/sumo.
+
+    :param output_dir: directory in which to create the run
+    :param grid_size: number of junctions along each side of the grid
+    :param spacing: distance between neighboring junctions
+    :param num_vehicles: number of vehicles
+    :param route_length: number of edges per route
+    :param begin: first time of the run
+    :param duration: number of timesteps of the run
+    :param depart_window: vehicles depart uniformly within this many
+        seconds of begin (default: half the duration)
+    :param bt_range: range of the bluetooth devices
+    :param incident_edge: id of the incident edge (default: the edge
+        leaving the center junction to the east)
+    :param incident_time: time from which the incident edge is closed
+        (default: a fifth into the run)
+    :param seed: random seed
+    :return: tuple of (sumo_dir, storage_dir) to load the run from
+    """
+
+    if spacing < SPEED_LIMIT:
+        raise ValueError("spacing must be at least the distance a vehicle drives per timestep")
+    if grid_size < 2:
+        raise ValueError("grid_size must be at least 2")
+
+    end = begin + duration
+    if depart_window is None:
+        depart_window = max(1, duration // 2)
+    if incident_time is None:
+        incident_time = begin + duration // 5
+
+    rng = np.random.default_rng(seed)
+
+    junctions, edges = build_grid(grid_size, spacing)
+
+    if incident_edge is None:
+        c = (grid_size - 1) // 2
+        incident_edge = column_name(c) + str(c) + column_name(c + 1) + str(c)
+    edge_index = {e[0]: k for k, e in enumerate(edges)}
+    if incident_edge not in edge_index:
+        raise ValueError("Unknown incident edge: {}".format(incident_edge))
+
+    routes = random_routes(rng, edges, num_vehicles, route_length)
+    departs = np.sort(rng.integers(begin, begin + min(depart_window, duration), size=num_vehicles)).tolist()
+
+    sumo_dir = os.path.join(output_dir, "sumo")
+    storage_dir = os.path.join(output_dir, "storage", "sumo")
+    os.makedirs(sumo_dir, exist_ok=True)
+    os.makedirs(storage_dir, exist_ok=True)
+
+    write_network(os.path.join(sumo_dir, NET_FILE), junctions, edges)
+    write_routes(os.path.join(sumo_dir, ROUTE_FILE), departs, routes, edges)
+    write_config(sumo_dir, begin, end, bt_range, incident_edge, incident_time)
+    simulate(storage_dir, junctions, edges, departs, routes, begin, end, bt_range, edge_index[incident_edge],
+             incident_time)
+
+    return sumo_dir, storage_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--output-dir", default="storage/synthetic",
+                        help="directory in which to create sumo/ and storage/sumo/")
+    parser.add_argument("--grid-size", type=int, default=8, help="number of junctions along each side")
+    parser.add_argument("--spacing", type=float, default=100, help="distance between neighboring junctions")
+    parser.add_argument("--vehicles", type=int, default=200, help="number of vehicles")
+    parser.add_argument("--route-length", type=int, default=10, help="number of edges per route")
+    parser.add_argument("--begin", type=int, default=0, help="first time of the run")
+    parser.add_argument("--duration", type=int, default=500, help="number of timesteps")
+    parser.add_argument("--depart-window", type=int, default=None,
+                        help="vehicles depart within this many seconds of begin (default: half the duration)")
+    parser.add_argument("--bt-range", type=float, default=45, help="range of the bluetooth devices")
+    parser.add_argument("--incident-edge", default=None,
+                        help="id of the incident edge (default: the edge east of the center junction)")
+    parser.add_argument("--incident-time", type=int, default=None,
+                        help="time at which the incident edge is closed (default: a fifth into the run)")
+    parser.add_argument("--seed", type=int, default=None, help="random seed")
+    args = parser.parse_args(argv)
+
+    sumo_dir, storage_dir = create_trace(args.output_dir, grid_size=args.grid_size, spacing=args.spacing,
+                                         num_vehicles=args.vehicles, route_length=args.route_length,
+                                         begin=args.begin, duration=args.duration,
+                                         depart_window=args.depart_window, bt_range=args.bt_range,
+                                         incident_edge=args.incident_edge, incident_time=args.incident_time,
+                                         seed=args.seed)
+
+    print("SumoReplay(sumo_dir={!r}, storage_dir={!r})".format(sumo_dir, storage_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,69 @@
 __author__ = 'Steven M. Hernandez'
 
 
+class EvaluationCounters:
+    """Keeps the evaluation metrics up to date as vehicles change.
+
+    Instead of rescanning every vehicle, tracked vehicles call remove()
+    before and add() after changing affected_at, received_at or msg, so
+    reading the metrics takes constant time.
+    """
+
+    def __init__(self):
+        self.num_affected = 0
+        self.num_received = 0
+        self.num_affected_and_received = 0
+        self.num_reacted = 0
+        self.sum_time_to_react = 0
+
+    def track(self, vehicle_net):
+        """Counts the current state of vehicles and follows their changes.
+
+        :param vehicle_net: List of vehicles
+        :return: None
+        """
+
+        for v in vehicle_net:
+            v.metrics = self
+            self.add(v)
+
+    def add(self, v):
+        self._count(v, 1)
+
+    def remove(self, v):
+        self._count(v, -1)
+
+    def _count(self, v, n):
+        # Mirrors the per-vehicle conditions of Evaluations
+        if v.affected_at is not None:
+            self.num_affected += n
+
+        if v.received_at is not None:
+            self.num_received += n
+
+        if (v.last_road_moving_on is not None
+                and v.received_before_incident_road):
+            self.num_affected_and_received += n
+
+        if (v.affected_at
+                and v.last_road_moving_on is not None
+                and v.received_before_incident_road):
+            self.num_reacted += n
+            self.sum_time_to_react += n * (v.affected_at - v.received_at)
+
+    def calculate(self):
+        """Gets every evaluation metric.
+
+        :return: same tuple as Evaluations.calculate
+        """
+
+        return (self.num_affected,
+                self.num_received,
+                self.num_affected_and_received,
+                0 if self.num_reacted == 0
+                else self.sum_time_to_react / self.num_reacted)
+
+
 class Evaluations:
     @staticmethod
     def get_num_affected(vehicle_net):
@@ -48,7 +111,21 @@ class Evaluations:
         return 0 if n == 0 else s / n
 
     @staticmethod
-    def run(t, vehicle_net):
+    def calculate(vehicle_net):
+        """Calculates every evaluation metric for the vehicles.
+
+        :param vehicle_net: List of vehicles
+        :return: tuple of (num_affected, num_received,
+            num_affected_and_received, avg_time_to_react)
+        """
+
+        return (Evaluations.get_num_affected(vehicle_net),
+                Evaluations.get_num_received(vehicle_net),
+                Evaluations.get_num_affected_and_received(vehicle_net),
+                Evaluations.get_average_time_to_react(vehicle_net))
+
+    @staticmethod
+    def format(t, metrics):
         s = "\n".join(["========",
                        "Time: {}",
                        "# affected: {}",
@@ -58,24 +135,8 @@ class Evaluations:
                        "",
                        ])
 
-        return s.format(t,
-                        Evaluations.get_num_affected(vehicle_net),
-                        Evaluations.get_num_received(vehicle_net),
-                        Evaluations.get_num_affected_and_received(vehicle_net),
-                        Evaluations.get_average_time_to_react(vehicle_net),
-                        )
+        return s.format(t, *metrics)
 
     @staticmethod
-    def write_to(directory, t, vehicle_net):
-        if t == 0:
-            f = open(directory + "evaluation.csv", "w")
-            f.write("time,num_affected,num_received,num_affected_and_received,avg_time_to_react\n")
-            f.close()
-        f = open(directory + "evaluation.csv", "a")
-        f.write(",".join(str(x) for x in [
-            t,
-            Evaluations.get_num_affected(vehicle_net),
-            Evaluations.get_num_received(vehicle_net),
-            Evaluations.get_num_affected_and_received(vehicle_net),
-            Evaluations.get_average_time_to_react(vehicle_net),
-        ]) + "\n")
+    def run(t, vehicle_net):
+        return Evaluations.format(t, Evaluations.calculate(vehicle_net))
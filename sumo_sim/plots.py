@@ -1,6 +1,8 @@
-import math
-import xml.etree.cElementTree as ET
+import xml.etree.ElementTree as ET
 import matplotlib.pyplot as plt
+import numpy as np
+
+from sumo_sim.traces import load_trace
 
 
 # Select which plots to generate in the below dictionary
@@ -20,28 +22,9 @@ def plots_to_generate():
 
 
 # Plot generation methods
-def avg_num_of_vehicles_per_road():
-    fcd = ET.parse('../storage/sumo/grid.fcd.out.xml').getroot()
-    max_num = []
-    min_num = []
-    avg_num = []
-    for t in fcd.findall("timestep"):
-        roads = {}
-        for v in t.findall("vehicle"):
-            current_road = v.get("lane").split("_")[0]
-            if current_road in roads:
-                roads[current_road] += 1
-            else:
-                roads[current_road] = 1
-        vals = [i for r, i in roads.items()]
-        if len(vals):
-            max_num.append(max(vals))
-            min_num.append(min(vals))
-            avg_num.append(sum(vals) / len(vals))
-        else:
-            max_num.append(0)
-            min_num.append(0)
-            avg_num.append(0)
+# Each one takes the series computed by aggregate_series()
+def avg_num_of_vehicles_per_road(series):
+    max_num, min_num, avg_num = series["vehicles_per_road"]
     x = range(len(avg_num))
     plt.plot(x, max_num, label="max")
     plt.plot(x, avg_num, label="avg")
@@ -52,16 +35,8 @@ def avg_num_of_vehicles_per_road():
     plt.show()
 
 
-# Plot generation methods
-def avg_occupancy_per_road():
-    edgeData = ET.parse('../storage/sumo/grid.edgeData.out.xml').getroot()
-    avg_occupancy = []
-    for i in edgeData.findall("interval"):
-        l = [float(e.get("occupancy")) for e in i.findall("edge") if e.get("occupancy")]
-        if len(l):
-            avg_occupancy.append(sum(l) / len(l))
-        else:
-            avg_occupancy.append(0)
+def avg_occupancy_per_road(series):
+    avg_occupancy = series["avg_occupancy"]
     x = range(len(avg_occupancy))
     y = avg_occupancy
     plt.plot(x, y)
@@ -70,15 +45,8 @@ def avg_occupancy_per_road():
     plt.show()
 
 
-def avg_speed_per_road():
-    edgeData = ET.parse('../storage/sumo/grid.edgeData.out.xml').getroot()
-    avg_speed = []
-    for i in edgeData.findall("interval"):
-        l = [float(e.get("speed")) for e in i.findall("edge") if e.get("speed")]
-        if len(l):
-            avg_speed.append(sum(l) / len(l))
-        else:
-            avg_speed.append(0)
+def avg_speed_per_road(series):
+    avg_speed = series["avg_speed"]
     x = range(len(avg_speed))
     y = avg_speed
     plt.plot(x, y)
@@ -87,12 +55,8 @@ def avg_speed_per_road():
     plt.show()
 
 
-def num_roads_occupied():
-    edgeData = ET.parse('../storage/sumo/grid.edgeData.out.xml').getroot()
-    num_roads_occupied = []
-    for i in edgeData.findall("interval"):
-        l = [float(e.get("occupancy")) for e in i.findall("edge") if e.get("occupancy")]
-        num_roads_occupied.append(len(l))
+def num_roads_occupied(series):
+    num_roads_occupied = series["num_roads_occupied"]
     x = range(len(num_roads_occupied))
     y = num_roads_occupied
     plt.plot(x, y)
@@ -101,12 +65,8 @@ def num_roads_occupied():
     plt.show()
 
 
-def num_vehicles_in_network():
-    fcd = ET.parse('../storage/sumo/grid.fcd.out.xml').getroot()
-    num_vehicles = []
-    for t in fcd.findall("timestep"):
-        vs = [v for v in t.findall("vehicle")]
-        num_vehicles.append(len(vs))
+def num_vehicles_in_network(series):
+    num_vehicles = series["num_vehicles"]
     x = range(len(num_vehicles))
     y = num_vehicles
     plt.plot(x, y)
@@ -115,12 +75,8 @@ def num_vehicles_in_network():
     plt.show()
 
 
-def num_stopped_vehicles_in_network():
-    fcd = ET.parse('../storage/sumo/grid.fcd.out.xml').getroot()
-    num_vehicles = []
-    for t in fcd.findall("timestep"):
-        vs = [v for v in t.findall("vehicle") if float(v.get("speed")) == 0]
-        num_vehicles.append(len(vs))
+def num_stopped_vehicles_in_network(series):
+    num_vehicles = series["num_stopped_vehicles"]
     x = range(len(num_vehicles))
     y = num_vehicles
     plt.plot(x, y)
@@ -129,14 +85,11 @@ def num_stopped_vehicles_in_network():
     plt.show()
 
 
-def percent_stopped_vehicles_in_network():
-    fcd = ET.parse('../storage/sumo/grid.fcd.out.xml').getroot()
+def percent_stopped_vehicles_in_network(series):
     num_vehicles = []
-    for t in fcd.findall("timestep"):
-        vs_stopped = [v for v in t.findall("vehicle") if float(v.get("speed")) == 0]
-        vs_total = [v for v in t.findall("vehicle")]
-
-        num_vehicles.append(0 if len(vs_total) == 0 else len(vs_stopped) / len(vs_total))
+    for vs_stopped, vs_total in zip(series["num_stopped_vehicles"],
+                                    series["num_vehicles"]):
+        num_vehicles.append(0 if vs_total == 0 else vs_stopped / vs_total)
     x = range(len(num_vehicles))
     y = num_vehicles
     plt.plot(x, y)
@@ -145,35 +98,17 @@ def percent_stopped_vehicles_in_network():
     plt.show()
 
 
-def avg_num_neighbors_per_vehicle():
-    sumocfg = ET.parse('../sumo/grid.sumocfg').getroot()
-    begin = int(sumocfg.find('time/begin').get('value'))
-    end = int(sumocfg.find('time/end').get('value'))
-    bt = ET.parse('../storage/sumo/grid.bt.out.xml').getroot()
+def avg_num_neighbors_per_vehicle(series):
+    begin, end = series["time_range"]
 
-    counts_per_vehicle_per_time = []
-    for v in bt.findall("bt"):
-        counts_per_time = [0] * (end - begin)
-        for s in v.findall("seen"):
-            t_beg = float(s.get("tBeg"))
-            t_end = float(s.get("tEnd"))
-            for t in range(math.ceil(t_beg), math.floor(t_end)):
-                counts_per_time[t] += 1
-        counts_per_vehicle_per_time.append(counts_per_time)
+    _, counts_per_vehicle_per_time = series["neighbor_counts"]
+    counts = counts_per_vehicle_per_time[:, begin:end]
+    num_neighbors = counts.sum(axis=0)
+    has_neighbors = num_neighbors != 0
 
-    avg_num_neighbors = []
-    max_num_neighbors = []
-    min_num_neighbors = []
-    for t in range(begin, end):
-        l = [x[t] for x in counts_per_vehicle_per_time]
-        if sum(l) == 0:
-            avg_num_neighbors.append(0)
-            max_num_neighbors.append(0)
-            min_num_neighbors.append(0)
-        else:
-            avg_num_neighbors.append(sum(l) / len(l))
-            max_num_neighbors.append(max(l))
-            min_num_neighbors.append(min(l))
+    avg_num_neighbors = np.where(has_neighbors, num_neighbors / max(len(counts), 1), 0)
+    max_num_neighbors = np.where(has_neighbors, counts.max(axis=0, initial=0), 0)
+    min_num_neighbors = np.where(has_neighbors, counts.min(axis=0, initial=0), 0)
 
     x = range(len(avg_num_neighbors))
     y = avg_num_neighbors
@@ -186,38 +121,16 @@ def avg_num_neighbors_per_vehicle():
     plt.show()
 
 
-def percent_without_neighbors():
-    sumocfg = ET.parse('../sumo/grid.sumocfg').getroot()
-    begin = int(sumocfg.find('time/begin').get('value'))
-    end = int(sumocfg.find('time/end').get('value'))
-    bt = ET.parse('../storage/sumo/grid.bt.out.xml').getroot()
-    fcd = ET.parse('../storage/sumo/grid.fcd.out.xml').getroot()
-
-    number_of_vehicles_per_time = []
-    vehicles_per_time = []
-    for t in fcd.findall("timestep"):
-        vs = [v.get("id") for v in t.findall("vehicle")]
-        vehicles_per_time.append(vs)
-        number_of_vehicles_per_time.append(len(vs))
-
-    counts_per_vehicle_per_time = {}
-    for v in bt.findall("bt"):
-        counts_per_time = [0] * (end - begin)
-        for s in v.findall("seen"):
-            t_beg = float(s.get("tBeg"))
-            t_end = float(s.get("tEnd"))
-            for t in range(math.ceil(t_beg), math.floor(t_end)):
-                counts_per_time[t] += 1
-        counts_per_vehicle_per_time[v.get("id")] = counts_per_time
+def percent_without_neighbors(series):
+    begin, end = series["time_range"]
+
+    number_of_vehicles_per_time = series["num_vehicles"]
+    number_without_neighbors_per_time = series["num_without_neighbors"]
 
     avg_num_neighbors = []
     for t in range(begin, end):
-        l = []
-        for i in vehicles_per_time[t]:
-            if counts_per_vehicle_per_time[i][t] == 0:
-                l.append(counts_per_vehicle_per_time[i][t])
         if number_of_vehicles_per_time[t]:
-            avg_num_neighbors.append(len(l) / number_of_vehicles_per_time[t])
+            avg_num_neighbors.append(number_without_neighbors_per_time[t] / number_of_vehicles_per_time[t])
         else:
             avg_num_neighbors.append(0)
 
@@ -229,41 +142,26 @@ def percent_without_neighbors():
     plt.show()
 
 
-def avg_percent_of_network_communicatable_by_vehicle():
-    sumocfg = ET.parse('../sumo/grid.sumocfg').getroot()
-    begin = int(sumocfg.find('time/begin').get('value'))
-    end = int(sumocfg.find('time/end').get('value'))
-    bt = ET.parse('../storage/sumo/grid.bt.out.xml').getroot()
-    fcd = ET.parse('../storage/sumo/grid.fcd.out.xml').getroot()
+def avg_percent_of_network_communicatable_by_vehicle(series):
+    begin, end = series["time_range"]
 
-    num_vehicles = []
-    for t in fcd.findall("timestep"):
-        vs = [v for v in t.findall("vehicle")]
-        num_vehicles.append(len(vs))
-
-    counts_per_vehicle_per_time = []
-    for v in bt.findall("bt"):
-        counts_per_time = [0] * (end - begin)
-        for s in v.findall("seen"):
-            t_beg = float(s.get("tBeg"))
-            t_end = float(s.get("tEnd"))
-            for t in range(math.ceil(t_beg), math.floor(t_end)):
-                counts_per_time[t] += 1
-        counts_per_vehicle_per_time.append(counts_per_time)
-
-    avg_percentage_of_network = []
-    max_percentage_of_network = []
-    min_percentage_of_network = []
-    for t in range(begin, end):
-        l = [x[t] for x in counts_per_vehicle_per_time]
-        if sum(l) == 0:
-            avg_percentage_of_network.append(0)
-            max_percentage_of_network.append(0)
-            min_percentage_of_network.append(0)
-        else:
-            avg_percentage_of_network.append(sum(l) / num_vehicles[t] / len(l))
-            max_percentage_of_network.append(max(l) / num_vehicles[t])
-            min_percentage_of_network.append(min(l) / num_vehicles[t])
+    num_vehicles = np.array(series["num_vehicles"][begin:end])
+
+    _, counts_per_vehicle_per_time = series["neighbor_counts"]
+    counts = counts_per_vehicle_per_time[:, begin:end]
+    num_neighbors = counts.sum(axis=0)
+    has_neighbors = num_neighbors != 0
+
+    # Only divide where there are neighbors (and so vehicles)
+    avg_percentage_of_network = np.zeros(len(num_neighbors))
+    max_percentage_of_network = np.zeros(len(num_neighbors))
+    min_percentage_of_network = np.zeros(len(num_neighbors))
+    avg_percentage_of_network[has_neighbors] = (num_neighbors[has_neighbors] / num_vehicles[has_neighbors]
+                                                / len(counts))
+    max_percentage_of_network[has_neighbors] = (counts.max(axis=0)[has_neighbors]
+                                                / num_vehicles[has_neighbors])
+    min_percentage_of_network[has_neighbors] = (counts.min(axis=0)[has_neighbors]
+                                                / num_vehicles[has_neighbors])
 
     x = range(len(avg_percentage_of_network))
     y = avg_percentage_of_network
@@ -276,6 +174,176 @@ def avg_percent_of_network_communicatable_by_vehicle():
     plt.show()
 
 
+# Series needed by each plot generation method
+def series_to_compute():
+    return {
+        avg_num_of_vehicles_per_road: ["vehicles_per_road"],
+        avg_occupancy_per_road: ["avg_occupancy"],
+        avg_speed_per_road: ["avg_speed"],
+        num_roads_occupied: ["num_roads_occupied"],
+        num_vehicles_in_network: ["num_vehicles"],
+        num_stopped_vehicles_in_network: ["num_stopped_vehicles"],
+        percent_stopped_vehicles_in_network: ["num_stopped_vehicles", "num_vehicles"],
+        avg_num_neighbors_per_vehicle: ["time_range", "neighbor_counts"],
+        percent_without_neighbors: ["time_range", "num_vehicles", "num_without_neighbors"],
+        avg_percent_of_network_communicatable_by_vehicle: ["time_range", "num_vehicles", "neighbor_counts"],
+    }
+
+
+EDGE_DATA_SERIES = {"avg_occupancy", "avg_speed", "num_roads_occupied"}
+
+
+def aggregate_series(plots):
+    """Computes the series of the selected plots.
+
+    The edge data file and the SUMO trace are each read at most once,
+    however many plots use them.
+
+    :param plots: plot generation methods, as in plots_to_generate()
+    :return: dict of series name to series
+    """
+
+    needed = set()
+    for plot in plots:
+        needed.update(series_to_compute()[plot])
+
+    series = {}
+
+    if needed & EDGE_DATA_SERIES:
+        series.update(_aggregate_edge_data('../storage/sumo/grid.edgeData.out.xml'))
+
+    if needed - EDGE_DATA_SERIES:
+        trace = load_trace('../sumo', '../storage/sumo')
+        series["time_range"] = (trace.begin, trace.end)
+        series.update(_aggregate_fcd(trace, needed))
+
+        if needed & {"neighbor_counts", "num_without_neighbors"}:
+            series["neighbor_counts"] = _neighbor_counts_per_vehicle(trace)
+
+        if "num_without_neighbors" in needed:
+            series["num_without_neighbors"] = _num_without_neighbors(trace, series["neighbor_counts"])
+
+    return series
+
+
+def _aggregate_edge_data(filepath):
+    avg_occupancy = []
+    avg_speed = []
+    num_roads_occupied = []
+
+    for _, i in ET.iterparse(filepath):
+        if i.tag != "interval":
+            continue
+
+        occupancies = [float(e.get("occupancy")) for e in i.findall("edge") if e.get("occupancy")]
+        speeds = [float(e.get("speed")) for e in i.findall("edge") if e.get("speed")]
+
+        avg_occupancy.append(sum(occupancies) / len(occupancies) if len(occupancies) else 0)
+        avg_speed.append(sum(speeds) / len(speeds) if len(speeds) else 0)
+        num_roads_occupied.append(len(occupancies))
+
+        i.clear()
+
+    return {
+        "avg_occupancy": avg_occupancy,
+        "avg_speed": avg_speed,
+        "num_roads_occupied": num_roads_occupied,
+    }
+
+
+def _aggregate_fcd(trace, needed):
+    series = {}
+    time_steps = trace.fcd_time_steps()
+
+    series["num_vehicles"] = np.diff(trace.arrays["fcd_offsets"]).tolist()
+
+    if "num_stopped_vehicles" in needed:
+        stopped = time_steps[trace.arrays["fcd_speed"] == 0]
+        series["num_stopped_vehicles"] = np.bincount(stopped, minlength=trace.num_time_steps).tolist()
+
+    if "vehicles_per_road" in needed:
+        # Number of vehicles on each occupied road at each time
+        roads = {}
+        road_of_string = np.array([roads.setdefault(s.split("_")[0], len(roads)) for s in trace.strings],
+                                  dtype=np.int64)
+        keys = time_steps * max(len(roads), 1) + road_of_string[trace.arrays["fcd_lane"]]
+        keys, counts = np.unique(keys, return_counts=True)
+        key_time_steps = keys // max(len(roads), 1)
+
+        num_roads = np.bincount(key_time_steps, minlength=trace.num_time_steps)
+        starts = np.cumsum(num_roads) - num_roads
+        occupied = num_roads > 0
+
+        max_num = np.zeros(trace.num_time_steps, dtype=np.int64)
+        min_num = np.zeros(trace.num_time_steps, dtype=np.int64)
+        sum_num = np.zeros(trace.num_time_steps, dtype=np.int64)
+        if len(counts):
+            max_num[occupied] = np.maximum.reduceat(counts, starts[occupied])
+            min_num[occupied] = np.minimum.reduceat(counts, starts[occupied])
+            sum_num[occupied] = np.add.reduceat(counts, starts[occupied])
+
+        avg_num = [s / n if n else 0 for s, n in zip(sum_num.tolist(), num_roads.tolist())]
+        series["vehicles_per_road"] = (max_num.tolist(), min_num.tolist(), avg_num)
+
+    return series
+
+
+def _neighbor_counts_per_vehicle(trace):
+    """Counts the neighbors of every bt vehicle at every second.
+
+    A sighting from tBeg to tEnd counts at the whole seconds
+    ceil(tBeg) <= t < floor(tEnd). Each sighting adds 1 at its first
+    second and -1 after its last one in a difference array, whose
+    prefix sums along time are the counts.
+
+    :param trace: SumoTrace to count in
+    :return: tuple of (List of bt vehicle ids, array of counts with one
+        row per bt vehicle and one column per second)
+    """
+
+    num_times = trace.end - trace.begin
+    offsets = trace.arrays["bt_offsets"]
+    num_vehicles = len(offsets) - 1
+
+    rows = np.repeat(np.arange(num_vehicles), np.diff(offsets))
+    first = np.clip(np.ceil(trace.arrays["bt_begin"]), 0, num_times).astype(np.int64)
+    last = np.clip(np.floor(trace.arrays["bt_end"]), 0, num_times).astype(np.int64)
+    seen = first < last
+
+    diff = np.zeros((num_vehicles, num_times + 1), dtype=np.int32)
+    np.add.at(diff, (rows[seen], first[seen]), 1)
+    np.add.at(diff, (rows[seen], last[seen]), -1)
+
+    ids = [trace.strings[v] for v in trace.arrays["bt_vehicle"].tolist()]
+
+    return ids, np.cumsum(diff[:, :-1], axis=1, dtype=np.int32)
+
+
+def _num_without_neighbors(trace, neighbor_counts):
+    # Number of vehicles present at each timestep that see no neighbors
+    ids, counts = neighbor_counts
+    num_times = counts.shape[1]
+
+    # Row of each string in the counts (the last one if an id repeats)
+    bt_row = np.full(len(trace.strings), -1)
+    bt_row[trace.arrays["bt_vehicle"]] = np.arange(len(ids))
+
+    time_steps = trace.fcd_time_steps()
+    rows = bt_row[trace.arrays["fcd_vehicle"]]
+    in_range = time_steps < num_times
+    time_steps = time_steps[in_range]
+    rows = rows[in_range]
+
+    # Vehicles without bt output never saw a neighbor
+    without = np.ones(len(rows), dtype=bool)
+    known = rows >= 0
+    without[known] = counts[rows[known], time_steps[known]] == 0
+
+    return np.bincount(time_steps[without], minlength=trace.num_time_steps).tolist()
+
+
+series = aggregate_series(plots_to_generate().values())
+
 for p in plots_to_generate():
     plt.figure(p)
-    plots_to_generate()[p]()
+    plots_to_generate()[p](series)
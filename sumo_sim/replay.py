@@ -0,0 +1,437 @@
+"""Contains code to replay a SUMO run with a message routing protocol."""
+
+__author__ = 'Steven M. Hernandez'
+
+import bisect
+import math
+import time
+
+from sumo_sim.evaluation import Evaluations, EvaluationCounters
+from sumo_sim.routing.GyTar import GyTar
+from sumo_sim.routing.UrbanRoutingIntersection import UrbanRoutingIntersection
+from sumo_sim.routing.Epidemic import Epidemic
+from sumo_sim.routing.Message import Message
+from sumo_sim.routing.UrbanRoutingHops import UrbanRoutingHops
+from sumo_sim.routing.InterestedOnlyProtocol import InterestedOnlyProtocol
+from sumo_sim.traces import load_trace, PositionIndex
+
+URBAN_ROUTING_INT_STRING = "urban-int"
+URBAN_ROUTING_HOPS_STRING = "urban-hops"
+EPIDEMIC_ROUTING_STRING = "epidemic"
+GYTAR_ROUTING_STRING = "gytar"
+INTERESTED_ONLY_ROUTING_STRING = "interested-only"
+
+# Phases of a replayed timestep, in the order they run
+STEP_PHASES = ("location", "routing", "neighbors", "forwarding", "evaluation")
+
+PHASES_CSV_HEADER = ("time,location_seconds,routing_seconds,neighbors_seconds,"
+                     "forwarding_seconds,evaluation_seconds,num_forwarders,"
+                     "neighbors_examined,num_handed_off\n")
+
+# Where neighbors come from: SUMO's bt output (whose range is set when
+# SUMO runs) or the FCD positions within settings["communication_radius"]
+BT_NEIGHBORS_STRING = "bt"
+FCD_NEIGHBORS_STRING = "fcd"
+
+ROUTING_PROTOCOLS = {
+    URBAN_ROUTING_HOPS_STRING: UrbanRoutingHops,
+    URBAN_ROUTING_INT_STRING: UrbanRoutingIntersection,
+    EPIDEMIC_ROUTING_STRING: Epidemic,
+    GYTAR_ROUTING_STRING: GyTar,
+    INTERESTED_ONLY_ROUTING_STRING: InterestedOnlyProtocol,
+}
+
+
+def default_settings():
+    return {
+        "intersection_radius": 25,
+        "communication_radius": 45,
+        "neighbors": BT_NEIGHBORS_STRING,
+        "protocol": {
+            "type": INTERESTED_ONLY_ROUTING_STRING,
+            "max_hops": 5,
+            "max_ints": 1,
+            "min_feed_ratio": 0.1,
+            "forwarder_ttl": 5,
+            "num_previous_roads": 10,
+            "num_future_roads": 10,
+        }
+    }
+
+
+class SUMOVehicle:
+    __slots__ = ('id', 'metrics', '_received_at', '_affected_at',
+                 'is_current_forwarder', 'is_cur_fwdr', 'original_forwarder',
+                 '_msg', 'exists', 'x', 'y', 'lane', 'edge', 'at_intersection',
+                 'roads', 'route_positions', 'left_road_at',
+                 'last_intersection', '_cur_road', 'route_index',
+                 'last_route_index', 'started_at',
+                 'last_road_moving_on', 'received_before_incident_road')
+
+    def __init__(self, id, route, left_road_at, last_road_moving_on):
+        self.id = id
+        # EvaluationCounters to notify of changes that affect metrics
+        self.metrics = None
+        self._received_at = None
+        self._affected_at = None
+        self.is_current_forwarder = False
+        self.is_cur_fwdr = False
+        self.original_forwarder = None
+        self._msg = None
+        self.exists = False
+        self.x = None
+        self.y = None
+        self.lane = None
+        self.edge = None
+        self.at_intersection = False
+        self.roads = route
+        # Positions of each road in the route, for O(1) route lookups
+        self.route_positions = {}
+        for k, r in enumerate(route):
+            self.route_positions.setdefault(r, []).append(k)
+        self.left_road_at = left_road_at
+        self.last_intersection = None
+        # Position of cur_road in the route (None when off the route, e.g.
+        # inside a junction), and the last position the vehicle was at
+        self.route_index = None
+        self.last_route_index = 0
+        self._cur_road = None
+        self.started_at = None
+        self.last_road_moving_on = last_road_moving_on
+        self.received_before_incident_road = None
+
+    @property
+    def received_at(self):
+        return self._received_at
+
+    @received_at.setter
+    def received_at(self, val):
+        self._update_metrics('_received_at', val)
+
+    @property
+    def affected_at(self):
+        return self._affected_at
+
+    @affected_at.setter
+    def affected_at(self, val):
+        self._update_metrics('_affected_at', val)
+
+    def _update_metrics(self, attr, val):
+        if self.metrics is not None:
+            self.metrics.remove(self)
+            setattr(self, attr, val)
+            self.metrics.add(self)
+        else:
+            setattr(self, attr, val)
+
+    @property
+    def cur_road(self):
+        return self._cur_road
+
+    @cur_road.setter
+    def cur_road(self, road):
+        if road == self._cur_road:
+            return
+        self._cur_road = road
+
+        positions = self.route_positions.get(road)
+        if positions is None:
+            self.route_index = None
+            return
+
+        # A road can appear more than once in a route (a vehicle may drive
+        # around a block), so take its first position from where the vehicle
+        # last was onwards. Looking up the road's first position in the
+        # route instead would put a vehicle on its second pass back at the
+        # first one. Positions before the last one are only taken if the
+        # vehicle went back, which a vehicle following its route can't do.
+        k = bisect.bisect_left(positions, self.last_route_index)
+        self.route_index = positions[k] if k < len(positions) else positions[-1]
+        self.last_route_index = self.route_index
+
+    @property
+    def passed_previous_intersection_at(self):
+        i = self._route_index()
+        if i == 0:
+            return self.started_at
+        return self.left_road_at[i - 1]
+
+    @property
+    def is_on_an_incident_road(self):
+        return self.last_road_moving_on is not None and self.last_road_moving_on == self.cur_road
+
+    @property
+    def msg(self):
+        return self._msg
+
+    @msg.setter
+    def msg(self, msg):
+        if self._msg is None:
+            self._update_metrics('received_before_incident_road',
+                                 not self.is_on_an_incident_road)
+            self._msg = msg
+
+    def _route_index(self):
+        if self.route_index is None:
+            raise ValueError("{} is not in route".format(self.cur_road))
+        return self.route_index
+
+    def route_contains_rd(self, settings, road):
+        if road not in self.route_positions:
+            return False
+        i = self._route_index()
+        r = (max(0, i - settings["num_previous_roads"]), min(len(self.roads), i + settings["num_future_roads"]))
+        # First occurrence of road at or after the start of the window
+        positions = self.route_positions[road]
+        k = bisect.bisect_left(positions, r[0])
+        return k < len(positions) and positions[k] < r[1]
+
+
+def distance(vehicle, junction):
+    return math.sqrt(pow(vehicle.x - junction[0], 2) + pow(vehicle.y - junction[1], 2))
+
+
+class SumoReplay:
+    """Replays the vehicles of a SUMO run while routing the incident message.
+
+    A replay goes through three phases:
+        1. load() reads the SUMO trace (done by run() if needed)
+        2. configure() chooses the protocol and its settings
+        3. run() replays the trace and returns the final metrics
+    The loaded trace is only read, so one SumoReplay can be configured
+    and run again any number of times.
+    """
+
+    def __init__(self, sumo_dir="sumo", storage_dir="storage/sumo",
+                 cache_dir=None):
+        """Custom constructor that only records where the trace is.
+
+        :param sumo_dir: directory of the SUMO configuration files
+        :param storage_dir: directory of the SUMO output files
+        :param cache_dir: directory of the trace cache (see load_trace)
+        """
+
+        self.sumo_dir = sumo_dir
+        self.storage_dir = storage_dir
+        self.cache_dir = cache_dir
+        self.trace = None
+        self.settings = default_settings()
+
+        # State of the last run, kept for inspection
+        self.vehicles = None
+        self.metrics = None
+
+    def load(self):
+        """Loads the SUMO trace, unless it is already loaded.
+
+        :return: self
+        """
+
+        if self.trace is not None:
+            return self
+
+        trace = load_trace(self.sumo_dir, self.storage_dir, self.cache_dir)
+
+        # Determine the last time a given vehicle was moving (e.g. when it was first queued)
+        vaporized = set(trace.vaporized_vehicle_ids)
+        last_time_moving = {}
+        for i in trace.vehicle_ids:
+            last_time_moving[i] = 0
+        last_time_moving.update(trace.last_time_moving)
+
+        self.vaporized = vaporized
+        self.last_time_moving = {k: v for k, v in last_time_moving.items() if k in vaporized}
+        self.last_road_moving_on = {k: v for k, v in trace.last_road_moving_on.items() if k in vaporized}
+        self.trace = trace
+
+        return self
+
+    def configure(self, settings=None):
+        """Sets the settings of the following runs.
+
+        :param settings: dict overriding entries of default_settings();
+            a "protocol" entry only overrides the protocol keys it has
+        :return: self
+        """
+
+        self.settings = default_settings()
+
+        if settings is not None:
+            for key in settings:
+                if key == "protocol":
+                    self.settings["protocol"].update(settings["protocol"])
+                else:
+                    self.settings[key] = settings[key]
+
+        if self.settings["protocol"]["type"] not in ROUTING_PROTOCOLS:
+            raise ValueError("Unknown routing protocol: {}".format(self.settings["protocol"]["type"]))
+
+        if self.settings["neighbors"] not in (BT_NEIGHBORS_STRING, FCD_NEIGHBORS_STRING):
+            raise ValueError("Unknown neighbor source: {}".format(self.settings["neighbors"]))
+
+        return self
+
+    def run(self, verbose=True, phases_file=None):
+        """Replays the whole trace with the configured settings.
+
+        :param verbose: whether to print the metrics at every timestep
+        :param phases_file: path of a CSV file to write the wall time of
+            each phase of STEP_PHASES and the work done at every
+            timestep to (see PHASES_CSV_HEADER), or None to not measure
+        :return: tuple of the final metrics (see EvaluationCounters.calculate)
+        """
+
+        self.load()
+
+        trace = self.trace
+        settings = self.settings
+
+        self.vehicles = {i: SUMOVehicle(i, trace.vehicle_routes[i.split(".")[0]],
+                                        trace.vehicles_left_road_at[i],
+                                        self.last_road_moving_on[i] if i in self.last_road_moving_on else None)
+                         for i in trace.vehicle_ids}
+
+        self.metrics = EvaluationCounters()
+        self.metrics.track(self.vehicles.values())
+
+        self._protocol = ROUTING_PROTOCOLS[settings["protocol"]["type"]]()
+
+        if settings["neighbors"] == FCD_NEIGHBORS_STRING:
+            self._neighbor_index = PositionIndex(trace, settings["communication_radius"])
+        else:
+            self._neighbor_index = trace.bt
+
+        # Vaporized vehicles that exist at the current time
+        self._existing_vaporized = {}
+        # Vehicles that are current forwarders, and their order in vehicles
+        self._forwarders = set()
+        self._vehicle_order = {i: k for k, i in enumerate(self.vehicles)}
+        self._verbose = verbose
+
+        if phases_file is None:
+            for t in range(trace.num_time_steps):
+                self._update_locations(t)
+                self._update_routing(t)
+                self._update_neighbors(t)
+                self._forward_message(t)
+                self._evaluate(t)
+        else:
+            with open(phases_file, "w") as f:
+                f.write(PHASES_CSV_HEADER)
+
+                for t in range(trace.num_time_steps):
+                    f.write(self._measure_step(t))
+
+        return self.metrics.calculate()
+
+    def phases(self):
+        """Gets the phases of a timestep in the order run() runs them.
+
+        :return: List of (name from STEP_PHASES, method taking the
+            timestep) tuples
+        """
+
+        return list(zip(STEP_PHASES, (self._update_locations,
+                                      self._update_routing,
+                                      self._update_neighbors,
+                                      self._forward_message,
+                                      self._evaluate)))
+
+    def _measure_step(self, t):
+        """Runs and measures the phases of one timestep.
+
+        :param t: index of the timestep
+        :return: row of the phases file
+        """
+
+        seconds = []
+        num_received = {}
+
+        for name, phase in self.phases():
+            num_received[name] = self.metrics.num_received
+            start = time.perf_counter()
+            phase(t)
+            seconds.append(time.perf_counter() - start)
+
+        neighbors_examined = sum(len(n) for n in self._neighbors)
+        num_handed_off = num_received["evaluation"] - num_received["forwarding"]
+
+        return ",".join(str(x) for x in [t, *seconds, len(self._current_forwarders),
+                                         neighbors_examined, num_handed_off]) + "\n"
+
+    def _update_locations(self, t):
+        # Determine which vehicles appear, move or disappear at this time
+        # Update their internal state
+        vehicles = self.vehicles
+        moved, left = self.trace.changes_at(t)
+
+        for i in left:
+            if i in vehicles:
+                vehicles[i].exists = False
+                self._existing_vaporized.pop(i, None)
+
+        for i, (x, y, lane) in moved.items():
+            if i in vehicles:
+                if not vehicles[i].exists:
+                    vehicles[i].started_at = t
+                    if i in self.vaporized:
+                        self._existing_vaporized[i] = True
+                vehicles[i].exists = True
+                vehicles[i].x = x
+                vehicles[i].y = y
+                vehicles[i].lane = lane
+                vehicles[i].edge = vehicles[i].lane.split("_")[0]
+                vehicles[i].cur_road = vehicles[i].edge
+
+    def _update_routing(self, t):
+        vehicles = self.vehicles
+        junctions = self.trace.junctions
+        to_and_from_for_edge = self.trace.to_and_from_for_edge
+
+        # For all vehicles which were stopped by the traffic event:
+        for i in self._existing_vaporized:
+            if vehicles[i].exists:
+                # Determine if vehicle is at an intersection
+                if vehicles[i].edge in to_and_from_for_edge:
+                    (j_to, j_from) = to_and_from_for_edge[vehicles[i].edge]
+                    junctions_to_search = [junctions[j_to], junctions[j_from]]
+                else:
+                    junctions_to_search = [junctions[vehicles[i].lane]]
+
+                vehicles[i].at_intersection = len(
+                    [1 for j in junctions_to_search if distance(vehicles[i], j) < self.settings["intersection_radius"]])
+
+                # If vehicle is stopped @time=t
+                if t == self.last_time_moving[i]:
+                    vehicles[i].affected_at = t
+                    # if vehicle was not notified in the past
+                    if vehicles[i].affected_at == t:
+                        # vehicle becomes current forwarder
+                        vehicles[i].is_current_forwarder = True
+                        self._forwarders.add(i)
+                        src_rd = vehicles[i].lane.split("_")[0]
+                        vehicles[i].msg = Message(src_rd=src_rd, dst_isect=to_and_from_for_edge[src_rd][0])
+
+    def _update_neighbors(self, t):
+        # Determine the neighbors of each current forwarder. They only
+        # depend on the trace, so they are all found before routing.
+        vehicles = self.vehicles
+        self._current_forwarders = sorted(self._forwarders, key=self._vehicle_order.get)
+        self._neighbors = [[vehicles[s] for s in self._neighbor_index.neighbors_at(str(i), t) if s in vehicles]
+                           for i in self._current_forwarders]
+
+    def _forward_message(self, t):
+        vehicles = self.vehicles
+
+        # For each current forwarder:
+        for i, neighbors in zip(self._current_forwarders, self._neighbors):
+            # routing protocol
+            remains_forwarder = self._protocol.route_message(vehicles[i], self.settings['protocol'], vehicles,
+                                                             neighbors, t, self.trace.to_and_from_for_edge)
+            vehicles[i].is_current_forwarder = remains_forwarder
+            if not remains_forwarder:
+                self._forwarders.discard(i)
+
+    def _evaluate(self, t):
+        if self._verbose:
+            print(Evaluations.format(t, self.metrics.calculate()))
@@ -1,6 +1,8 @@
 class Message:
     """POD class representing the incident message."""
 
+    __slots__ = ('src_rd', 'dst_isect', 'hop_cnt')
+
     def __init__(self, src_rd, dst_isect):
         """Custom constructor for Message object.
 
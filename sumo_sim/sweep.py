@@ -0,0 +1,209 @@
+"""Contains code to replay one SUMO trace under many settings at once."""
+
+__author__ = 'Steven M. Hernandez'
+
+
+import contextlib
+import itertools
+import multiprocessing
+import os
+import time
+import traceback
+
+from sumo_sim.replay import SumoReplay, ROUTING_PROTOCOLS
+
+# Sweep keys that belong in the "protocol" section of the settings
+PROTOCOL_KEYS = ("type", "max_hops", "max_ints", "min_feed_ratio",
+                 "forwarder_ttl", "num_previous_roads", "num_future_roads")
+
+SUMMARY_CSV_HEADER = ("run,intersection_radius,communication_radius,"
+                      "neighbors,type,max_hops,max_ints,"
+                      "min_feed_ratio,forwarder_ttl,num_previous_roads,"
+                      "num_future_roads,num_affected,num_received,"
+                      "num_affected_and_received,avg_time_to_react,"
+                      "wall_time,error\n")
+
+# Loaded replay that forked workers inherit from the parent process
+_replay = None
+
+
+def expand_grid(grid):
+    """Builds every combination of the values in a settings grid.
+
+    :param grid: dict of setting name to List of values to try, e.g.
+        {"type": ["urban-hops", "epidemic"], "max_hops": [3, 5]}.
+        Keys are "intersection_radius", "communication_radius",
+        "neighbors" or one of PROTOCOL_KEYS.
+    :return: List of dicts with one value per setting
+    """
+
+    keys = list(grid)
+
+    return [dict(zip(keys, values))
+            for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def run_combination(combination, run_storage, instrument=False):
+    """Replays the shared trace with one combination of settings.
+
+    Every timestep's metrics go to output.txt in the run directory,
+    next to settings.txt. If the replay fails, its traceback goes there
+    too and the run has no metrics, so one failing protocol does not
+    stop the other runs of a sweep.
+
+    :param combination: dict of setting name to value
+    :param run_storage: directory to log the run to
+    :param instrument: whether to also write the phase timings of every
+        timestep to phases.csv (see SumoReplay.run)
+    :return: dict of the combination, settings and final metrics
+    """
+
+    settings = {"protocol": {}}
+
+    for key in combination:
+        if key in PROTOCOL_KEYS:
+            settings["protocol"][key] = combination[key]
+        else:
+            settings[key] = combination[key]
+
+    start = time.time()
+    os.makedirs(run_storage)
+
+    _replay.configure(settings)
+
+    with open(os.path.join(run_storage, "settings.txt"), "w") as f:
+        f.write("\n".join('"{}": {}'.format(k, v)
+                          for k, v in _replay.settings.items()))
+
+    metrics = (None, None, None, None)
+    error = None
+
+    with open(os.path.join(run_storage, "output.txt"), "w") as fp, \
+            contextlib.redirect_stdout(fp):
+        try:
+            metrics = _replay.run(phases_file=os.path.join(run_storage, "phases.csv") if instrument else None)
+        except Exception as e:
+            traceback.print_exc(file=fp)
+            error = repr(e)
+
+    num_affected, num_received, num_affected_and_received, \
+        avg_time_to_react = metrics
+
+    return {
+        "run_storage": run_storage,
+        "settings": _replay.settings,
+        "num_affected": num_affected,
+        "num_received": num_received,
+        "num_affected_and_received": num_affected_and_received,
+        "avg_time_to_react": avg_time_to_react,
+        "wall_time": time.time() - start,
+        "error": error,
+    }
+
+
+def _run_indexed_combination(args):
+    return run_combination(*args)
+
+
+def run_sweep(grid, sumo_dir="sumo", storage_dir="storage/sumo",
+              storage="storage/experiments/", processes=None, instrument=False):
+    """Replays a SUMO trace under every combination of a settings grid.
+
+    The trace is loaded once, then worker processes are forked from
+    this one so they all read the same trace pages (copy-on-write)
+    instead of loading their own copy. This needs the "fork" start
+    method, which is available on Linux and macOS.
+
+    :param grid: settings grid (see expand_grid)
+    :param sumo_dir: directory of the SUMO configuration files
+    :param storage_dir: directory of the SUMO output files
+    :param storage: directory in which to create the sweep directory
+    :param processes: number of worker processes (default: CPU count)
+    :param instrument: whether every run also writes phases.csv
+    :return: List of run results ordered like expand_grid(grid)
+    """
+
+    global _replay
+
+    combinations = expand_grid(grid)
+
+    for combination in combinations:
+        protocol_type = combination.get("type")
+        if protocol_type is not None and protocol_type not in ROUTING_PROTOCOLS:
+            raise ValueError("Unknown routing protocol: {}".format(protocol_type))
+
+    _replay = SumoReplay(sumo_dir=sumo_dir, storage_dir=storage_dir).load()
+
+    # Build the lazily computed change index before forking, so that the
+    # workers share it too
+    if _replay.trace.num_time_steps:
+        _replay.trace.changes_at(0)
+
+    sweep_storage = os.path.join(storage, "sumo-sweep-{}".format(time.time()))
+    os.makedirs(sweep_storage)
+
+    args = [(combination, os.path.join(sweep_storage, "{:04d}".format(i)), instrument)
+            for i, combination in enumerate(combinations)]
+
+    context = multiprocessing.get_context("fork")
+    with context.Pool(processes=processes) as pool:
+        results = pool.map(_run_indexed_combination, args)
+
+    write_summary(os.path.join(sweep_storage, "summary.csv"), results)
+
+    return results
+
+
+def summary_row(r):
+    """Gets the values of the summary line of a run.
+
+    :param r: dict returned by run_combination
+    :return: List of values in SUMMARY_CSV_HEADER order
+    """
+
+    protocol = r["settings"]["protocol"]
+
+    return [
+        os.path.basename(r["run_storage"]),
+        r["settings"]["intersection_radius"],
+        r["settings"]["communication_radius"],
+        r["settings"]["neighbors"],
+        protocol["type"],
+        protocol["max_hops"],
+        protocol["max_ints"],
+        protocol["min_feed_ratio"],
+        protocol["forwarder_ttl"],
+        protocol["num_previous_roads"],
+        protocol["num_future_roads"],
+        r["num_affected"],
+        r["num_received"],
+        r["num_affected_and_received"],
+        r["avg_time_to_react"],
+        r["wall_time"],
+        # Quoted, since the message may contain commas
+        "" if r["error"] is None
+        else '"{}"'.format(r["error"].replace('"', '""')),
+    ]
+
+
+def write_summary(filepath, results):
+    """Writes one CSV line per run with its settings and final metrics.
+
+    :param filepath: path to the summary file
+    :param results: List of dicts returned by run_combination
+    :return: None
+    """
+
+    with open(filepath, "w") as f:
+        f.write(SUMMARY_CSV_HEADER)
+
+        for r in results:
+            f.write(",".join(str(x) for x in summary_row(r)) + "\n")
+
+
+if __name__ == '__main__':
+    run_sweep(grid={
+        "type": ["urban-hops", "urban-int", "epidemic", "gytar",
+                 "interested-only"],
+        "max_hops": [5],
+    })
@@ -0,0 +1,692 @@
+"""Contains code to read the traces SUMO writes during a simulation."""
+
+import array
+import hashlib
+import os
+import shutil
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+SUMOCFG_FILE = "grid.sumocfg"
+NET_FILE = "grid.net.xml"
+ROUTE_FILE = "grid.rou.xml"
+BT_OUTPUT_FILE = "grid.bt.out.xml"
+VEHROUTE_OUTPUT_FILE = "grid.vehroute.out.xml"
+FCD_OUTPUT_FILE = "grid.fcd.out.xml"
+
+# Change this whenever the cached arrays change so old caches are rebuilt
+TRACE_CACHE_VERSION = 2
+
+
+def _iter_fcd(filepath):
+    """Streams the timesteps of an FCD file, clearing elements as it goes.
+
+    :param filepath: path to the FCD output file
+    :return: generator of (time, List of (id, x, y, lane, speed))
+    """
+
+    rows = None
+    t = None
+    root = None
+
+    for event, elem in ET.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            elif elem.tag == "timestep":
+                t = float(elem.get("time"))
+                rows = []
+            continue
+
+        if elem.tag == "vehicle":
+            rows.append((elem.get("id"), float(elem.get("x")),
+                         float(elem.get("y")), elem.get("lane"),
+                         float(elem.get("speed"))))
+            elem.clear()
+        elif elem.tag == "timestep":
+            yield t, rows
+            root.clear()
+
+
+class SightingIndex:
+    """Answers which vehicles each vehicle saw at a given time.
+
+    The sightings of each vehicle in a bt output file are kept in a
+    centered interval tree, so a query only looks at the sightings
+    that may contain the time of interest instead of all of them.
+    """
+
+    def __init__(self, sightings):
+        """Custom constructor for SightingIndex object.
+
+        The tree of a vehicle is built the first time it is queried.
+
+        :param sightings: dict of vehicle id to List of
+            (seen vehicle id, tBeg, tEnd) in file order, or any object
+            with the same get() method
+        """
+
+        self.sightings = sightings
+        self.trees = {}
+
+    def neighbors_at(self, vehicle_id, t):
+        """Gets the vehicles a vehicle sees at a time.
+
+        A sighting counts if tBeg < t < tEnd.
+
+        :param vehicle_id: id of the vehicle
+        :param t: time of interest
+        :return: List of seen vehicle ids in file order
+        """
+
+        if vehicle_id not in self.trees:
+            seen = self.sightings.get(vehicle_id, ())
+            intervals = [(t_beg, t_end, k, seen_id)
+                         for k, (seen_id, t_beg, t_end) in enumerate(seen)]
+            self.trees[vehicle_id] = _build_interval_tree(intervals)
+
+        node = self.trees[vehicle_id]
+        found = []
+
+        while node is not None:
+            if t < node.center:
+                for interval in node.by_begin:
+                    if interval[0] >= t:
+                        break
+                    found.append(interval)
+                node = node.left
+            elif t > node.center:
+                for interval in node.by_end:
+                    if interval[1] <= t:
+                        break
+                    found.append(interval)
+                node = node.right
+            else:
+                found.extend(i for i in node.by_begin if i[0] < t < i[1])
+                node = None
+
+        found.sort(key=lambda i: i[2])
+
+        return [i[3] for i in found]
+
+
+class _IntervalNode:
+    __slots__ = ('center', 'by_begin', 'by_end', 'left', 'right')
+
+    def __init__(self, center, by_begin, by_end, left, right):
+        self.center = center
+        self.by_begin = by_begin
+        self.by_end = by_end
+        self.left = left
+        self.right = right
+
+
+def _build_interval_tree(intervals):
+    """Builds a centered interval tree.
+
+    :param intervals: List of (tBeg, tEnd, ...) tuples
+    :return: root _IntervalNode, or None if there are no intervals
+    """
+
+    if not intervals:
+        return None
+
+    # The median endpoint lies in at least one interval, so every node
+    # holds at least one interval and the recursion ends
+    endpoints = sorted(t for i in intervals for t in i[:2])
+    center = endpoints[len(endpoints) // 2]
+
+    left = [i for i in intervals if i[1] < center]
+    right = [i for i in intervals if i[0] > center]
+    here = [i for i in intervals if i[0] <= center <= i[1]]
+
+    return _IntervalNode(center,
+                         sorted(here, key=lambda i: i[0]),
+                         sorted(here, key=lambda i: i[1], reverse=True),
+                         _build_interval_tree(left),
+                         _build_interval_tree(right))
+
+
+def _iter_bt(filepath):
+    """Streams the devices of a bt output file, clearing elements as it goes.
+
+    :param filepath: path to the bt output file
+    :return: generator of (id, List of (seen id, tBeg, tEnd))
+    """
+
+    seen = None
+    root = None
+
+    for event, elem in ET.iterparse(filepath, events=("start", "end")):
+        if event == "start":
+            if root is None:
+                root = elem
+            elif elem.tag == "bt":
+                seen = []
+            continue
+
+        if elem.tag == "seen":
+            seen.append((elem.get("id"), float(elem.get("tBeg")),
+                         float(elem.get("tEnd"))))
+            elem.clear()
+        elif elem.tag == "bt":
+            yield elem.get("id"), seen
+            root.clear()
+
+
+class PositionIndex:
+    """Answers which vehicles are within a radius of each vehicle.
+
+    Neighbors are found from the FCD positions of a trace rather than
+    from its bt output, whose range is fixed when SUMO runs, so the same
+    trace can be replayed under any communication radius. The vehicles
+    of a timestep are bucketed into square cells of one radius, so a
+    query only measures the distance to the vehicles in the nine cells
+    around the vehicle of interest.
+    """
+
+    def __init__(self, trace, radius):
+        """Custom constructor for PositionIndex object.
+
+        The cells of a timestep are built the first time it is queried,
+        and only the cells of the last queried timestep are kept.
+
+        :param trace: SumoTrace to read the positions from
+        :param radius: communication radius of the vehicles
+        """
+
+        self.trace = trace
+        self.radius = radius
+
+        self._k = None
+        self._ids = None
+        self._rows = None
+        self._x = None
+        self._y = None
+        self._cell_of_row = None
+        self._cells = None
+
+    def neighbors_at(self, vehicle_id, k):
+        """Gets the vehicles closer than the radius to a vehicle.
+
+        :param vehicle_id: id of the vehicle
+        :param k: index of the timestep
+        :return: List of vehicle ids in FCD file order
+        """
+
+        if k != self._k:
+            self._build_cells(k)
+
+        row = self._rows.get(vehicle_id)
+
+        if row is None:
+            return []
+
+        c_x, c_y = self._cell_of_row[row]
+        candidates = [self._cells[c] for c in
+                      ((c_x + d_x, c_y + d_y)
+                       for d_x in (-1, 0, 1) for d_y in (-1, 0, 1))
+                      if c in self._cells]
+        candidates = np.sort(np.concatenate(candidates))
+
+        dist = np.hypot(self._x[candidates] - self._x[row],
+                        self._y[candidates] - self._y[row])
+        found = candidates[(dist < self.radius) & (candidates != row)]
+
+        return [self._ids[r] for r in found.tolist()]
+
+    def _build_cells(self, k):
+        """Buckets the vehicles present at a timestep into cells.
+
+        :param k: index of the timestep
+        :return: None
+        """
+
+        arrays = self.trace.arrays
+        a, b = arrays["fcd_offsets"][k:k + 2].tolist()
+
+        self._ids = [self.trace.strings[v]
+                     for v in arrays["fcd_vehicle"][a:b].tolist()]
+        self._rows = {v: r for r, v in enumerate(self._ids)}
+        self._x = arrays["fcd_x"][a:b]
+        self._y = arrays["fcd_y"][a:b]
+
+        c_x = np.floor(self._x / self.radius).astype(np.int64)
+        c_y = np.floor(self._y / self.radius).astype(np.int64)
+        self._cell_of_row = list(zip(c_x.tolist(), c_y.tolist()))
+
+        # Group the rows of each cell, keeping file order within a cell
+        order = np.lexsort((c_y, c_x))
+        starts = np.flatnonzero(np.diff(c_x[order]) | np.diff(c_y[order])) + 1
+        groups = np.split(order, starts)
+        self._cells = {self._cell_of_row[g[0]]: g for g in groups if len(g)}
+
+        self._k = k
+
+
+class SumoTrace:
+    """Columnar copy of the configuration and outputs of a SUMO run.
+
+    Every id, lane and edge name is stored once in a string table and
+    referred to by its index, and per-timestep or per-vehicle lists are
+    flattened into arrays with offsets, so a trace is saved as one .npy
+    file per array and memory-mapped back (see load_trace). Locations
+    are only turned into Python objects one timestep at a time.
+    """
+
+    def __init__(self, arrays):
+        """Custom constructor that unpacks the small parts of a trace.
+
+        :param arrays: dict of array name to NumPy array, as built by
+            _read_trace_arrays
+        """
+
+        self.arrays = arrays
+        self.strings = strings = arrays["strings"].tolist()
+
+        self.begin, self.end = arrays["time_range"].tolist()
+
+        self.junctions = {
+            strings[j]: (x, y) for j, x, y in zip(
+                arrays["junction_id"].tolist(),
+                arrays["junction_x"].tolist(),
+                arrays["junction_y"].tolist())}
+
+        self.to_and_from_for_edge = {
+            strings[e]: (strings[f], strings[t]) for e, f, t in zip(
+                arrays["edge_id"].tolist(),
+                arrays["edge_from"].tolist(),
+                arrays["edge_to"].tolist())}
+
+        route_edges = [strings[e] for e in arrays["route_edges"].tolist()]
+        self.vehicle_routes = {
+            strings[v]: route_edges[a:b] for v, a, b in zip(
+                arrays["route_vehicle"].tolist(),
+                arrays["route_offsets"][:-1].tolist(),
+                arrays["route_offsets"][1:].tolist())}
+
+        exit_times = arrays["exit_times"].tolist()
+        vehroute_vehicles = [strings[v]
+                             for v in arrays["vehroute_vehicle"].tolist()]
+        self.vehicles_left_road_at = {
+            v: exit_times[a:b] for v, a, b in zip(
+                vehroute_vehicles,
+                arrays["exit_offsets"][:-1].tolist(),
+                arrays["exit_offsets"][1:].tolist())}
+
+        self.vehicle_ids = vehroute_vehicles
+        self.vaporized_vehicle_ids = [
+            v for v, arrived in zip(vehroute_vehicles,
+                                    arrays["vehroute_arrived"].tolist())
+            if not arrived]
+
+        self.num_time_steps = len(arrays["fcd_time"])
+        self.last_time_moving, self.last_road_moving_on = \
+            self._find_last_moving()
+
+        self.bt = SightingIndex(_SightingColumns(arrays, strings))
+
+        # Built on the first call to changes_at
+        self._changes = None
+
+    def changes_at(self, k):
+        """Gets the vehicles that appear, move or disappear at a timestep.
+
+        Replaying these changes in order only touches the vehicles whose
+        state differs from the previous timestep.
+
+        :param k: index of the timestep
+        :return: tuple of
+            - dict of vehicle id to (x, y, lane) for the vehicles that
+              appear or move, in file order
+            - List of the ids of the vehicles that disappear
+        """
+
+        if self._changes is None:
+            self._changes = self._find_changes()
+
+        rows, row_offsets, left, left_offsets = self._changes
+        strings = self.strings
+
+        a, b = row_offsets[k:k + 2].tolist()
+        rows = rows[a:b]
+        moved = {strings[v]: (x, y, strings[lane]) for v, x, y, lane in zip(
+            self.arrays["fcd_vehicle"][rows].tolist(),
+            self.arrays["fcd_x"][rows].tolist(),
+            self.arrays["fcd_y"][rows].tolist(),
+            self.arrays["fcd_lane"][rows].tolist())}
+
+        a, b = left_offsets[k:k + 2].tolist()
+
+        return moved, [strings[v] for v in left[a:b].tolist()]
+
+    def _find_changes(self):
+        """Finds the FCD rows that differ from the previous timestep.
+
+        :return: tuple of (changed rows, their offsets per timestep,
+            vehicles that disappear, their offsets per timestep)
+        """
+
+        time_steps = self.fcd_time_steps()
+        vehicles = self.arrays["fcd_vehicle"]
+
+        # Follow each vehicle through the timesteps it is present in
+        order = np.lexsort((time_steps, vehicles))
+        v = vehicles[order]
+        s = time_steps[order]
+
+        # Whether a row continues the row before it (same vehicle in the
+        # previous timestep)
+        continued = np.zeros(len(order), dtype=bool)
+        continued[1:] = (v[1:] == v[:-1]) & (s[1:] == s[:-1] + 1)
+
+        unchanged = continued.copy()
+        for key in ("fcd_x", "fcd_y", "fcd_lane"):
+            column = self.arrays[key][order]
+            unchanged[1:] &= column[1:] == column[:-1]
+
+        rows = np.sort(order[~unchanged])
+        row_offsets = np.searchsorted(time_steps[rows],
+                                      np.arange(self.num_time_steps + 1))
+
+        # A row that is not continued means its vehicle disappears in the
+        # following timestep
+        last = np.ones(len(order), dtype=bool)
+        last[:-1] = ~continued[1:]
+        left_at = s[last] + 1
+        left_order = np.argsort(left_at, kind="stable")
+        left = v[last][left_order]
+        left_offsets = np.searchsorted(left_at[left_order],
+                                       np.arange(self.num_time_steps + 1))
+
+        return rows, row_offsets, left, left_offsets
+
+    def fcd_time_steps(self):
+        """Gets the timestep index of every FCD row.
+
+        :return: array with one timestep index per row
+        """
+
+        return np.repeat(np.arange(self.num_time_steps),
+                         np.diff(self.arrays["fcd_offsets"]))
+
+    def _find_last_moving(self):
+        """Finds when and on which road each vehicle was last moving.
+
+        :return: tuple of dicts of vehicle id to time and to road
+        """
+
+        rows = np.flatnonzero(self.arrays["fcd_speed"] != 0)
+
+        # The first occurrence in the reversed rows is the last one
+        rows = rows[::-1]
+        _, first = np.unique(self.arrays["fcd_vehicle"][rows],
+                             return_index=True)
+        rows = np.sort(rows[first])
+
+        time_steps = np.searchsorted(self.arrays["fcd_offsets"], rows,
+                                     side="right") - 1
+        times = self.arrays["fcd_time"][time_steps].tolist()
+        vehicles = self.arrays["fcd_vehicle"][rows].tolist()
+        lanes = self.arrays["fcd_lane"][rows].tolist()
+
+        last_time_moving = {}
+        last_road_moving_on = {}
+
+        for v, t, lane in zip(vehicles, times, lanes):
+            last_time_moving[self.strings[v]] = t
+            last_road_moving_on[self.strings[v]] = \
+                self.strings[lane].split("_")[0]
+
+        return last_time_moving, last_road_moving_on
+
+
+class _SightingColumns:
+    """Reads the sightings of one vehicle out of the trace arrays."""
+
+    def __init__(self, arrays, strings):
+        self.arrays = arrays
+        self.strings = strings
+        self.index = {}
+
+        for k, v in enumerate(arrays["bt_vehicle"].tolist()):
+            self.index.setdefault(strings[v], []).append(k)
+
+    def get(self, vehicle_id, default=None):
+        if vehicle_id not in self.index:
+            return default
+
+        offsets = self.arrays["bt_offsets"]
+        ret_list = []
+
+        for k in self.index[vehicle_id]:
+            a, b = offsets[k:k + 2].tolist()
+            ret_list.extend(zip(
+                [self.strings[s] for s in self.arrays["bt_seen"][a:b].tolist()],
+                self.arrays["bt_begin"][a:b].tolist(),
+                self.arrays["bt_end"][a:b].tolist()))
+
+        return ret_list
+
+
+def load_trace(sumo_dir="sumo", storage_dir="storage/sumo", cache_dir=None):
+    """Loads a SUMO run, parsing its XML files only if they are not cached.
+
+    The cache of a run is a directory with one uncompressed .npy file
+    per array, which are memory-mapped rather than read, so loading
+    takes about the same time whatever the size of the trace, and
+    forked processes share the same pages.
+
+    The cache directory is named after a hash of the contents of the
+    source files, so a changed configuration or a new run is parsed
+    again. Hashing a large FCD file takes seconds, so the hash is also
+    recorded under the sizes and modification times of the files and
+    only computed again when one of them changes.
+
+    The bt output is optional; without it the trace has no sightings,
+    and neighbors can be found from positions with PositionIndex.
+
+    :param sumo_dir: directory of the SUMO configuration files
+    :param storage_dir: directory of the SUMO output files
+    :param cache_dir: directory of the cache files
+        (default: a "cache" directory in storage_dir)
+    :return: SumoTrace of the run
+    """
+
+    if cache_dir is None:
+        cache_dir = os.path.join(storage_dir, "cache")
+
+    sources = ([os.path.join(sumo_dir, f)
+                for f in (SUMOCFG_FILE, NET_FILE, ROUTE_FILE)]
+               + [os.path.join(storage_dir, f)
+                  for f in (BT_OUTPUT_FILE, VEHROUTE_OUTPUT_FILE,
+                            FCD_OUTPUT_FILE)])
+
+    if not os.path.exists(sources[3]):
+        sources[3] = None
+
+    present = [f for f in sources if f is not None]
+
+    stamp_file = os.path.join(cache_dir, _stamp_files(present) + ".stamp")
+    key = None
+
+    if os.path.exists(stamp_file):
+        with open(stamp_file) as f:
+            key = f.read().strip()
+
+    if key is None or not os.path.isdir(os.path.join(cache_dir, key)):
+        key = _hash_files(present)
+
+    trace_dir = os.path.join(cache_dir, key)
+
+    if not os.path.isdir(trace_dir):
+        arrays = _read_trace_arrays(*sources)
+
+        # Written under another name first so that an interrupted write
+        # never leaves a broken cache behind
+        tmp_dir = "{}.{}.tmp".format(trace_dir, os.getpid())
+        os.makedirs(tmp_dir)
+        for name, a in arrays.items():
+            np.save(os.path.join(tmp_dir, name + ".npy"), a)
+        try:
+            os.replace(tmp_dir, trace_dir)
+        except OSError:
+            # Another process (e.g. a parallel sweep) wrote the same cache
+            # first, so use its copy
+            if not os.path.isdir(trace_dir):
+                raise
+            shutil.rmtree(tmp_dir)
+
+    if not os.path.exists(stamp_file):
+        tmp_file = "{}.{}.tmp".format(stamp_file, os.getpid())
+        with open(tmp_file, "w") as f:
+            f.write(key)
+        os.replace(tmp_file, stamp_file)
+
+    arrays = {name[:-len(".npy")]: np.load(os.path.join(trace_dir, name),
+                                           mmap_mode="r")
+              for name in os.listdir(trace_dir) if name.endswith(".npy")}
+
+    return SumoTrace(arrays)
+
+
+def _stamp_files(filepaths):
+    """Hashes the paths, sizes and modification times of some files.
+
+    :param filepaths: List of paths to files
+    :return: hex digest of the files
+    """
+
+    h = hashlib.sha1(str(TRACE_CACHE_VERSION).encode())
+
+    for filepath in filepaths:
+        st = os.stat(filepath)
+        h.update("{}|{}|{}\n".format(os.path.abspath(filepath), st.st_size,
+                                     st.st_mtime_ns).encode())
+
+    return h.hexdigest()
+
+
+def _hash_files(filepaths):
+    """Hashes the contents of some files.
+
+    :param filepaths: List of paths to files
+    :return: hex digest of the files
+    """
+
+    h = hashlib.sha1(str(TRACE_CACHE_VERSION).encode())
+
+    for filepath in filepaths:
+        h.update(str(os.path.getsize(filepath)).encode())
+
+        with open(filepath, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+
+    return h.hexdigest()
+
+
+def _read_trace_arrays(sumocfg_file, net_file, route_file, bt_file,
+                       vehroute_file, fcd_file):
+    """Parses the files of a SUMO run into columnar arrays.
+
+    bt_file may be None, which gives a trace without sightings.
+
+    :return: dict of array name to NumPy array (see SumoTrace)
+    """
+
+    strings = {}
+
+    def intern(s):
+        return strings.setdefault(s, len(strings))
+
+    sumocfg = ET.parse(sumocfg_file).getroot()
+    net = ET.parse(net_file).getroot()
+    rou = ET.parse(route_file).getroot()
+    vehroute = ET.parse(vehroute_file).getroot()
+
+    arrays = {
+        "time_range": np.array([int(sumocfg.find('time/begin').get('value')),
+                                int(sumocfg.find('time/end').get('value'))]),
+    }
+
+    junctions = net.findall("junction")
+    arrays["junction_id"] = np.array([intern(j.get("id")) for j in junctions],
+                                     dtype=np.int32)
+    arrays["junction_x"] = np.array([float(j.get("x")) for j in junctions])
+    arrays["junction_y"] = np.array([float(j.get("y")) for j in junctions])
+
+    edges = [e for e in net.findall("edge") if not e.get("function")]
+    for key, attr in (("edge_id", "id"), ("edge_from", "from"),
+                      ("edge_to", "to")):
+        arrays[key] = np.array([intern(e.get(attr)) for e in edges],
+                               dtype=np.int32)
+
+    route_vehicle = array.array("i")
+    route_offsets = array.array("q", [0])
+    route_edges = array.array("i")
+    for x in rou.findall("vehicle"):
+        route_vehicle.append(intern(x.get("id")))
+        route_edges.extend(intern(e) for e in
+                           x.find("route").get("edges").split(" "))
+        route_offsets.append(len(route_edges))
+
+    vehroute_vehicle = array.array("i")
+    vehroute_arrived = array.array("b")
+    exit_offsets = array.array("q", [0])
+    exit_times = array.array("d")
+    for x in vehroute.findall("vehicle"):
+        vehroute_vehicle.append(intern(x.get("id")))
+        vehroute_arrived.append(bool(x.get("arrival")))
+        exit_times.extend(float(y) for y in
+                          x.find("route").get("exitTimes").split(" ") if y)
+        exit_offsets.append(len(exit_times))
+
+    fcd_time = array.array("d")
+    fcd_offsets = array.array("q", [0])
+    fcd_columns = [array.array(c) for c in "iddid"]
+    for t, rows in _iter_fcd(fcd_file):
+        fcd_time.append(t)
+        for vid, x, y, lane, speed in rows:
+            for column, value in zip(fcd_columns, (intern(vid), x, y,
+                                                   intern(lane), speed)):
+                column.append(value)
+        fcd_offsets.append(len(fcd_columns[0]))
+
+    bt_vehicle = array.array("i")
+    bt_offsets = array.array("q", [0])
+    bt_columns = [array.array(c) for c in "idd"]
+    for vid, seen in (_iter_bt(bt_file) if bt_file is not None else ()):
+        bt_vehicle.append(intern(vid))
+        for seen_id, t_beg, t_end in seen:
+            for column, value in zip(bt_columns,
+                                     (intern(seen_id), t_beg, t_end)):
+                column.append(value)
+        bt_offsets.append(len(bt_columns[0]))
+
+    for key, column in (("route_vehicle", route_vehicle),
+                        ("route_offsets", route_offsets),
+                        ("route_edges", route_edges),
+                        ("vehroute_vehicle", vehroute_vehicle),
+                        ("vehroute_arrived", vehroute_arrived),
+                        ("exit_offsets", exit_offsets),
+                        ("exit_times", exit_times),
+                        ("fcd_time", fcd_time),
+                        ("fcd_offsets", fcd_offsets),
+                        ("fcd_vehicle", fcd_columns[0]),
+                        ("fcd_x", fcd_columns[1]),
+                        ("fcd_y", fcd_columns[2]),
+                        ("fcd_lane", fcd_columns[3]),
+                        ("fcd_speed", fcd_columns[4]),
+                        ("bt_vehicle", bt_vehicle),
+                        ("bt_offsets", bt_offsets),
+                        ("bt_seen", bt_columns[0]),
+                        ("bt_begin", bt_columns[1]),
+                        ("bt_end", bt_columns[2])):
+        arrays[key] = np.frombuffer(column, dtype=column.typecode)
+
+    arrays["vehroute_arrived"] = arrays["vehroute_arrived"].astype(bool)
+    arrays["strings"] = np.array(list(strings), dtype=str)
+
+    return arrays
@@ -0,0 +1,26 @@
+"""Top-level script to run a parameter sweep across all CPU cores.
+
+"""
+
+
+__author__ = 'Adam Morrissett', 'Steven M. Hernandez'
+
+
+from vanet_sim import sweep
+
+
+if __name__ == '__main__':
+    grid = {
+        "vehicle_file": ['vehicles.100.generated.csv',
+                         'vehicles.200.generated.csv'],
+        "communication_radius": [45],
+        "type": ["urban-hops", "urban-int", "epidemic", "gytar"],
+        "max_hops": [3, 5],
+        "max_ints": [1],
+        "min_feed_ratio": [0.1],
+    }
+
+    sweep.run_sweep(grid=grid,
+                    intersection_file='intersections.generated.csv',
+                    road_file='roads.generated.csv',
+                    time_duration=100)
@@ -0,0 +1,96 @@
+"""Contains code to save simulations to files and load them back."""
+
+__author__ = 'Steven M. Hernandez'
+
+
+import gzip
+import pickle
+
+# gzip level of checkpoint files: several times faster to write than the
+# default 9, for files only a few percent larger
+COMPRESS_LEVEL = 6
+
+
+def save(obj, filepath):
+    """Pickles an object graph to a gzip file.
+
+    Vehicles, roads and the objects around them refer to each other in
+    long chains (e.g. through neighbor lists), which would exhaust the
+    recursion limit of a plain pickle. Instances of the slotted classes
+    of vanet_sim are therefore pickled as empty objects, and their
+    attributes follow in flat batches once every object is known.
+
+    :param obj: object to save
+    :param filepath: path to the file
+    :return: None
+    """
+
+    with gzip.open(filepath, "wb", compresslevel=COMPRESS_LEVEL) as f:
+        pickler = _CheckpointPickler(f)
+        pickler.dump(obj)
+
+        done = 0
+        while done < len(pickler.deferred):
+            batch = pickler.deferred[done:]
+            done = len(pickler.deferred)
+            pickler.dump([(o, _get_slots(o)) for o in batch])
+
+        pickler.dump(None)
+
+
+def load(filepath):
+    """Loads an object graph saved by save().
+
+    :param filepath: path to the file
+    :return: the saved object
+    """
+
+    with gzip.open(filepath, "rb") as f:
+        unpickler = pickle.Unpickler(f)
+        obj = unpickler.load()
+
+        batch = unpickler.load()
+        while batch is not None:
+            for o, state in batch:
+                for name, value in state.items():
+                    setattr(o, name, value)
+            batch = unpickler.load()
+
+    return obj
+
+
+class _CheckpointPickler(pickle.Pickler):
+    def __init__(self, f):
+        super().__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.deferred = []
+
+    def reducer_override(self, obj):
+        cls = type(obj)
+
+        if cls.__module__.startswith("vanet_sim.") and "__slots__" in cls.__dict__:
+            self.deferred.append(obj)
+            return _new_object, (cls,)
+
+        return NotImplemented
+
+
+def _new_object(cls):
+    return cls.__new__(cls)
+
+
+def _get_slots(obj):
+    state = {}
+
+    for cls in type(obj).__mro__:
+        for name in cls.__dict__.get("__slots__", ()):
+            if getattr(type(obj), name, None) is not cls.__dict__.get(name):
+                # Shadowed by a subclass, e.g. a property of a view
+                continue
+
+            try:
+                state[name] = getattr(obj, name)
+            except AttributeError:
+                # Slot never set
+                pass
+
+    return state
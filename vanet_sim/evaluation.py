@@ -1,6 +1,75 @@
 __author__ = 'Steven M. Hernandez'
 
 
+import atexit
+import os
+import threading
+
+EVALUATION_CSV_HEADER = "time,num_affected,num_received,num_affected_and_received,avg_time_to_react\n"
+
+
+class EvaluationCounters:
+    """Keeps the evaluation metrics up to date as vehicles change.
+
+    Instead of rescanning the vehicle network, tracked vehicles call
+    remove() before and add() after changing affected_at or
+    received_at, so reading the metrics takes constant time.
+    """
+
+    def __init__(self):
+        self.num_affected = 0
+        self.num_received = 0
+        self.num_affected_and_received = 0
+        self.num_reacted = 0
+        self.sum_time_to_react = 0
+
+    def track(self, vehicle_net):
+        """Counts the current state of vehicles and follows their changes.
+
+        :param vehicle_net: List of vehicles
+        :return: None
+        """
+
+        for v in vehicle_net:
+            v.metrics = self
+            self.add(v)
+
+    def add(self, v):
+        self._count(v, 1)
+
+    def remove(self, v):
+        self._count(v, -1)
+
+    def _count(self, v, n):
+        # Mirrors the per-vehicle conditions of Evaluations
+        if v.affected_at is not None:
+            self.num_affected += n
+
+        if v.received_at is not None:
+            self.num_received += n
+
+        if (v.affected_at is not None and v.received_at is not None
+                and not v.original_forwarder):
+            self.num_affected_and_received += n
+
+        if (v.affected_at is not None and v.received_at is not None
+                and v.affected_at >= v.received_at):
+            self.num_reacted += n
+            self.sum_time_to_react += n * (v.affected_at - v.received_at)
+
+    def calculate(self):
+        """Gets every evaluation metric.
+
+        :return: same tuple as Evaluations.calculate
+        """
+
+        return (self.num_affected,
+                self.num_received,
+                self.num_affected_and_received,
+                0 if self.num_reacted == 0
+                else self.sum_time_to_react / self.num_reacted)
+
+
 class Evaluations:
     @staticmethod
     def get_num_affected(vehicle_net):
@@ -47,7 +116,21 @@ class Evaluations:
         return 0 if n == 0 else s / n
 
     @staticmethod
-    def run(t, vehicle_net):
+    def calculate(vehicle_net):
+        """Calculates every evaluation metric for the vehicle network.
+
+        :param vehicle_net: List of vehicles
+        :return: tuple of (num_affected, num_received,
+            num_affected_and_received, avg_time_to_react)
+        """
+
+        return (Evaluations.get_num_affected(vehicle_net),
+                Evaluations.get_num_received(vehicle_net),
+                Evaluations.get_num_affected_and_received(vehicle_net),
+                Evaluations.get_average_time_to_react(vehicle_net))
+
+    @staticmethod
+    def format(t, metrics):
         s = "\n".join(["========",
                        "Time: {}",
                        "# affected: {}",
@@ -57,24 +140,115 @@ class Evaluations:
                        "",
                        ])
 
-        return s.format(t,
-                        Evaluations.get_num_affected(vehicle_net),
-                        Evaluations.get_num_received(vehicle_net),
-                        Evaluations.get_num_affected_and_received(vehicle_net),
-                        Evaluations.get_average_time_to_react(vehicle_net),
-                        )
+        return s.format(t, *metrics)
+
+    @staticmethod
+    def run(t, vehicle_net):
+        return Evaluations.format(t, Evaluations.calculate(vehicle_net))
 
     @staticmethod
-    def write_to(directory, t, vehicle_net):
-        if t == 0:
-            f = open(directory + "evaluation.csv", "w")
-            f.write("time,num_affected,num_received,num_affected_and_received,avg_time_to_react\n")
-            f.close()
-        f = open(directory + "evaluation.csv", "a")
-        f.write(",".join(str(x) for x in [
-            t,
-            Evaluations.get_num_affected(vehicle_net),
-            Evaluations.get_num_received(vehicle_net),
-            Evaluations.get_num_affected_and_received(vehicle_net),
-            Evaluations.get_average_time_to_react(vehicle_net),
-        ]) + "\n")
+    def format_row(t, metrics):
+        return ",".join(str(x) for x in [t, *metrics]) + "\n"
+
+
+class EvaluationWriter:
+    """Writes evaluation rows to a CSV file from a background thread.
+
+    Rows are buffered in memory and written out once flush_rows rows
+    are waiting or flush_interval seconds have passed, whichever comes
+    first, so the simulation loop never waits on the file system.
+    close() writes the remaining rows. A writer that is never closed
+    (e.g. when Simulation.step is called directly, or the GUI is closed
+    early) is closed when the interpreter exits, so no rows are lost.
+
+    If writing fails, the thread stops and the error is raised by the
+    next call to write() or close().
+    """
+
+    def __init__(self, filepath, flush_rows=1000, flush_interval=1.0,
+                 header=EVALUATION_CSV_HEADER):
+        """Custom constructor that opens the file and starts the thread.
+
+        The header is written if the file is new or empty, otherwise
+        rows are appended to it.
+
+        :param filepath: path to the CSV file
+        :param flush_rows: number of buffered rows that triggers a write
+        :param flush_interval: maximum seconds between writes
+        :param header: first line of the file (any rows of a time and a
+            tuple of values can be written, not only metrics)
+        """
+
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.closed = False
+
+        self._file = open(filepath, "a")
+        if os.path.getsize(filepath) == 0:
+            self._file.write(header)
+
+        self._rows = []
+        self._closing = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def write(self, t, metrics):
+        """Queues one row of metrics.
+
+        :param t: simulation time of the row
+        :param metrics: tuple from EvaluationCounters.calculate
+        :return: None
+        """
+
+        if self._error is not None:
+            raise self._error
+
+        with self._cond:
+            self._rows.append((t, metrics))
+
+            if len(self._rows) >= self.flush_rows:
+                self._cond.notify()
+
+    def close(self):
+        """Writes the remaining rows and closes the file."""
+
+        if self.closed:
+            return
+
+        atexit.unregister(self.close)
+
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+
+        self._thread.join()
+        self._file.close()
+        self.closed = True
+
+        if self._error is not None:
+            raise self._error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closing and len(self._rows) < self.flush_rows:
+                    self._cond.wait(self.flush_interval)
+
+                rows, self._rows = self._rows, []
+                closing = self._closing
+
+            if rows:
+                try:
+                    self._file.write("".join(Evaluations.format_row(t, m)
+                                             for t, m in rows))
+                    self._file.flush()
+                except Exception as e:
+                    self._error = e
+                    return
+
+            if closing:
+                return
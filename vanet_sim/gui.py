@@ -187,6 +187,8 @@ class MapFrame(tk.Frame):
 
         if self.simulator.cur_time <= self.time_dur:
             self.canvas.after(_GUI_REFRESH_PERIOD, self.step_sim)
+        else:
+            self.simulator.close()
 
 
 if __name__ == '__main__':
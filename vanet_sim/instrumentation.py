@@ -0,0 +1,60 @@
+"""Contains code to measure where the time of simulation steps goes."""
+
+__author__ = 'Steven M. Hernandez'
+
+
+import time
+
+from vanet_sim.evaluation import EvaluationWriter
+
+PHASES_CSV_HEADER = ("time,location_seconds,neighbors_seconds,routing_seconds,"
+                     "forwarding_seconds,evaluation_seconds,num_forwarders,"
+                     "neighbors_examined,num_handed_off\n")
+
+
+class StepInstrumentation:
+    """Times each phase of the simulation steps and counts their work.
+
+    For every step, one row is written with the wall time of each phase
+    of STEP_PHASES, the number of current forwarders, the number of
+    their neighbors (which the routing protocol examines) and the
+    number of vehicles the message was handed off to.
+    """
+
+    def __init__(self, filepath):
+        """Custom constructor that opens the phases file.
+
+        :param filepath: path to the CSV file (appended to if it exists)
+        """
+
+        self.writer = EvaluationWriter(filepath, header=PHASES_CSV_HEADER)
+
+    def step(self, sim):
+        """Runs and measures one step of a simulation.
+
+        :param sim: Simulation to step
+        :return: None
+        """
+
+        t = sim.cur_time
+        seconds = []
+        results = {}
+        num_received = {}
+
+        for name, phase in sim.phases():
+            num_received[name] = sim.metrics.num_received
+            start = time.perf_counter()
+            results[name] = phase()
+            seconds.append(time.perf_counter() - start)
+
+        cur_fwdrs = results["forwarding"]
+        neighbors_examined = sum(len(v.neighbors) for v in cur_fwdrs)
+        num_handed_off = num_received["evaluation"] - num_received["forwarding"]
+
+        self.writer.write(t, (*seconds, len(cur_fwdrs), neighbors_examined,
+                              num_handed_off))
+
+        sim.advance_time()
+
+    def close(self):
+        self.writer.close()
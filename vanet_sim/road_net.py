@@ -4,17 +4,40 @@
 __author__ = 'Adam Morrissett'
 
 
+import bisect
 import csv
 import math
 
 
 INTERSECTION_RADIUS = 5
 
+# Vehicles closer than this to the vehicle ahead of them slow down
+FOLLOWING_DISTANCE = 16
+
 
 class RoadMap:
     def __init__(self, intersection_file, road_file):
         self.int_dict = RoadMap._build_intersection_grid(intersection_file)
         self.road_dict = RoadMap._build_road_net(road_file, self.int_dict)
+        RoadMap._find_nearby_roads(self.road_dict, FOLLOWING_DISTANCE)
+
+    def index_vehicles(self, vehicle_net):
+        """Rebuilds the per-road position index from scratch.
+
+        Vehicles keep the index up to date as they move, so this is
+        only needed when the same RoadMap is reused for a new vehicle
+        network.
+
+        :param vehicle_net: List of vehicles on this road map
+        :return: None
+        """
+
+        for r in self.road_dict.values():
+            r.vehicles = []
+            r.positions = []
+
+        for v in vehicle_net:
+            v.cur_road.add_vehicle(v)
 
     @staticmethod
     def _build_intersection_grid(filepath):
@@ -64,6 +87,59 @@ class RoadMap:
 
         return ret_dict
 
+    @staticmethod
+    def _find_nearby_roads(roads, distance):
+        """Records for every road the other roads passing within distance.
+
+        Along with each nearby road, the range of positions on the first
+        road from which the nearby road can be within distance is kept
+        so lookups can skip it everywhere else.
+
+        :param roads: dict of Road objects
+        :param distance: maximum distance between two roads
+        :return: None
+        """
+
+        # Bucket roads into coarse cells so only roads sharing a cell
+        # are compared.
+        cell_size = distance * 4
+        order = {}
+        buckets = {}
+
+        for i, r in enumerate(roads.values()):
+            order[r.name] = i
+            x_lo, x_hi = sorted((r.start_node.x_pos, r.end_node.x_pos))
+            y_lo, y_hi = sorted((r.start_node.y_pos, r.end_node.y_pos))
+
+            for c_x in range(math.floor((x_lo - distance) / cell_size),
+                             math.floor((x_hi + distance) / cell_size) + 1):
+                for c_y in range(math.floor((y_lo - distance) / cell_size),
+                                 math.floor((y_hi + distance) / cell_size) + 1):
+                    if (c_x, c_y) not in buckets:
+                        buckets[(c_x, c_y)] = []
+                    buckets[(c_x, c_y)].append(r)
+
+        candidates = {r.name: {} for r in roads.values()}
+
+        for bucket in buckets.values():
+            for r0 in bucket:
+                for r1 in bucket:
+                    candidates[r0.name][r1.name] = r1
+
+        for r0 in roads.values():
+            r0.nearby_roads = []
+
+            for r1 in sorted(candidates[r0.name].values(),
+                             key=lambda r: order[r.name]):
+                if r1 is r0 or _segment_distance(r0, r1) >= distance:
+                    continue
+
+                ends = (r0.project(r1.start_node.x_pos, r1.start_node.y_pos),
+                        r0.project(r1.end_node.x_pos, r1.end_node.y_pos))
+                r0.nearby_roads.append((r1,
+                                        min(ends) - distance,
+                                        max(ends) + distance))
+
     @staticmethod
     def _calc_dist(start, end):
         return math.sqrt(pow((end.x_pos - start.x_pos), 2)
@@ -73,6 +149,10 @@ class RoadMap:
 class Road:
     """Plain old data (POD) object for a road segment."""
 
+    __slots__ = ('name', 'start_node', 'end_node', 'length', 'spd_lim',
+                 'is_obstructed', 'obstruction_pos', 'vehicles', 'positions',
+                 'nearby_roads')
+
     def __init__(self, name, start_node, end_node, length, spd_lim,
                  is_obstructed):
         """Custom constructor for Road object.
@@ -96,10 +176,75 @@ class Road:
         else:
             self.obstruction_pos = -1
 
+        # Vehicles currently on the road ordered by cur_pos, alongside
+        # their positions so lookups can bisect.
+        self.vehicles = []
+        self.positions = []
+
+        # Other roads close enough for vehicles to interact across them,
+        # as (road, lo, hi) where lo < cur_pos < hi on this road is the
+        # stretch from which the other road can be close enough.
+        self.nearby_roads = []
+
+    def add_vehicle(self, vehicle):
+        """Inserts a vehicle into the position index.
+
+        :param vehicle: vehicle on this road
+        :return: None
+        """
+
+        i = bisect.bisect_right(self.positions, vehicle.cur_pos)
+        self.positions.insert(i, vehicle.cur_pos)
+        self.vehicles.insert(i, vehicle)
+
+    def remove_vehicle(self, vehicle, pos):
+        """Removes a vehicle from the position index.
+
+        :param vehicle: vehicle to remove
+        :param pos: position the vehicle was indexed at
+        :return: None
+        """
+
+        i = bisect.bisect_left(self.positions, pos)
+
+        while i < len(self.positions) and self.positions[i] == pos:
+            if self.vehicles[i] is vehicle:
+                del self.positions[i]
+                del self.vehicles[i]
+                return
+            i += 1
+
+    def vehicles_between(self, lo, hi):
+        """Gets the vehicles with lo < cur_pos < hi.
+
+        :param lo: lower bound on position (exclusive)
+        :param hi: upper bound on position (exclusive)
+        :return: List of vehicles ordered by position
+        """
+
+        return self.vehicles[bisect.bisect_right(self.positions, lo):
+                             bisect.bisect_left(self.positions, hi)]
+
+    def project(self, x, y):
+        """Gets the position along the road closest to a point.
+
+        :param x: x coordinate of point
+        :param y: y coordinate of point
+        :return: position along the (infinite) road line
+        """
+
+        x_range = self.end_node.x_pos - self.start_node.x_pos
+        y_range = self.end_node.y_pos - self.start_node.y_pos
+
+        return (((x - self.start_node.x_pos) * x_range
+                 + (y - self.start_node.y_pos) * y_range) / self.length)
+
 
 class Intersection:
     """Plain old data (POD) object for an intersection."""
 
+    __slots__ = ('name', 'x_pos', 'y_pos')
+
     def __init__(self, name, x_pos, y_pos):
         """Custom constructor for Intersection object.
 
@@ -110,3 +255,53 @@ class Intersection:
         self.name = name
         self.x_pos = x_pos
         self.y_pos = y_pos
+
+
+def _segment_distance(r0, r1):
+    """Calculates the shortest distance between two road segments.
+
+    :param r0: first road
+    :param r1: second road
+    :return: the Euclidean distance between the closest points
+    """
+
+    p = (r0.start_node.x_pos, r0.start_node.y_pos)
+    q = (r0.end_node.x_pos, r0.end_node.y_pos)
+    r = (r1.start_node.x_pos, r1.start_node.y_pos)
+    s = (r1.end_node.x_pos, r1.end_node.y_pos)
+
+    if _segments_intersect(p, q, r, s):
+        return 0
+
+    return min(_point_segment_distance(p, r, s),
+               _point_segment_distance(q, r, s),
+               _point_segment_distance(r, p, q),
+               _point_segment_distance(s, p, q))
+
+
+def _point_segment_distance(p, a, b):
+    d_x = b[0] - a[0]
+    d_y = b[1] - a[1]
+    length_sq = d_x ** 2 + d_y ** 2
+
+    if length_sq == 0:
+        t = 0
+    else:
+        t = ((p[0] - a[0]) * d_x + (p[1] - a[1]) * d_y) / length_sq
+        t = max(0, min(1, t))
+
+    return math.sqrt((a[0] + t * d_x - p[0]) ** 2
+                     + (a[1] + t * d_y - p[1]) ** 2)
+
+
+def _segments_intersect(p, q, r, s):
+    def orientation(a, b, c):
+        return (b[0] - a[0]) * (c[1] - a[1]) - (b[1] - a[1]) * (c[0] - a[0])
+
+    d0 = orientation(r, s, p)
+    d1 = orientation(r, s, q)
+    d2 = orientation(p, q, r)
+    d3 = orientation(p, q, s)
+
+    return ((d0 > 0) != (d1 > 0) and d0 != 0 and d1 != 0
+            and (d2 > 0) != (d3 > 0) and d2 != 0 and d3 != 0)
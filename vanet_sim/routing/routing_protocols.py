@@ -1,6 +1,8 @@
 class Message:
     """POD class representing the incident message."""
 
+    __slots__ = ('src_rd', 'dst_isect', 'hop_cnt')
+
     def __init__(self, src_rd, dst_isect):
         """Custom constructor for Message object.
 
@@ -16,6 +18,23 @@ class Message:
 class BaseRoutingProtocol:
     """Abstract base class for routing protocols."""
 
+    def route_all(self, cur_fwdrs, settings, vehicle_net, cur_time):
+        """Routes the message from every current forwarder.
+
+        Forwarders are handled one after another in the given order, so
+        a vehicle reached by one forwarder is seen as having received
+        the message by the following ones.
+
+        :param cur_fwdrs: List of current forwarders
+        :param settings: protocol settings
+        :param vehicle_net: vehicle network
+        :param cur_time: current simulation time
+        :return: None
+        """
+
+        for cur_fwdr in cur_fwdrs:
+            self.route_message(cur_fwdr, settings, vehicle_net, cur_time)
+
     def route_message(self, cur_fwdr, settings, vehicle_net, cur_time):
         """Gives message to all next forwarders.
 
@@ -38,18 +57,30 @@ class BaseRoutingProtocol:
                                                     cur_fwdr.neighbors,
                                                     hop_num=0)
 
-            for nxt_fwdr in nxt_fwdrs:
-                if not self.should_remain_current_forwarder_after_sharing():
-                    vehicle_net[cur_fwdr.id - 1].is_cur_fwdr = False
-
-                vehicle_net[nxt_fwdr.id - 1].received_at = cur_time
-                vehicle_net[nxt_fwdr.id - 1].is_cur_fwdr = True
-                cur_fwdr.msg.hop_cnt += 1
-                vehicle_net[nxt_fwdr.id - 1].msg = cur_fwdr.msg
-                self.share_additional_data(cur_fwdr, nxt_fwdr)
+            self.share_message(cur_fwdr, nxt_fwdrs, vehicle_net, cur_time)
         else:
             vehicle_net[cur_fwdr.id - 1].is_cur_fwdr = False
 
+    def share_message(self, cur_fwdr, nxt_fwdrs, vehicle_net, cur_time):
+        """Gives the message of a forwarder to its next forwarders.
+
+        :param cur_fwdr: current forwarder
+        :param nxt_fwdrs: List of next forwarders
+        :param vehicle_net: vehicle network
+        :param cur_time: current simulation time
+        :return: None
+        """
+
+        for nxt_fwdr in nxt_fwdrs:
+            if not self.should_remain_current_forwarder_after_sharing():
+                vehicle_net[cur_fwdr.id - 1].is_cur_fwdr = False
+
+            vehicle_net[nxt_fwdr.id - 1].received_at = cur_time
+            vehicle_net[nxt_fwdr.id - 1].is_cur_fwdr = True
+            cur_fwdr.msg.hop_cnt += 1
+            vehicle_net[nxt_fwdr.id - 1].msg = cur_fwdr.msg
+            self.share_additional_data(cur_fwdr, nxt_fwdr)
+
     @staticmethod
     def choose_next_forwarders(settings, f_curr, neighbors, hop_num):
         """Chooses the next forwarders.
@@ -213,6 +244,55 @@ class UrbanRoutingIntersection(UrbanRoutingProtocol):
 
 
 class Epidemic(BaseRoutingProtocol):
+    def route_all(self, cur_fwdrs, settings, vehicle_net, cur_time):
+        """Routes the message from every current forwarder.
+
+        Every forwarder shares with all of its neighbors that have not
+        received the message, so once most vehicles are forwarders it
+        is cheaper to start from the vehicles still waiting for the
+        message. Each of them gets it from the first forwarder (in
+        cur_fwdrs order) that has it as a neighbor, which is the one
+        that would reach it when routing forwarder by forwarder.
+
+        :param cur_fwdrs: List of current forwarders
+        :param settings: protocol settings
+        :param vehicle_net: vehicle network
+        :param cur_time: current simulation time
+        :return: None
+        """
+
+        # The EvaluationCounters of the network know how many vehicles
+        # are waiting without scanning it (see EvaluationCounters.track)
+        metrics = vehicle_net[0].metrics if vehicle_net else None
+
+        if metrics is not None:
+            num_waiting = len(vehicle_net) - metrics.num_received
+        else:
+            num_waiting = sum(1 for v in vehicle_net if v.received_at is None)
+
+        if num_waiting >= len(cur_fwdrs):
+            super().route_all(cur_fwdrs, settings, vehicle_net, cur_time)
+            return
+
+        # Vehicles that have not received the message cannot be
+        # original forwarders, so these are all the possible receivers
+        waiting = [v for v in vehicle_net if v.received_at is None]
+
+        fwdr_order = {f.id: i for i, f in enumerate(cur_fwdrs)}
+        nxt_fwdrs = [[] for _ in cur_fwdrs]
+
+        # Being neighbors is symmetric, so a waiting vehicle's
+        # neighbors are the forwarders it could receive from
+        for v in waiting:
+            i = min((fwdr_order[n.id] for n in v.neighbors
+                     if n.id in fwdr_order), default=None)
+
+            if i is not None:
+                nxt_fwdrs[i].append(v)
+
+        for cur_fwdr, nxt in zip(cur_fwdrs, nxt_fwdrs):
+            self.share_message(cur_fwdr, nxt, vehicle_net, cur_time)
+
     @staticmethod
     def choose_next_forwarders(settings, f_curr, neighbors, hop_num):
         ret_lst = []
@@ -315,15 +395,29 @@ def _calc_dist(isect0, isect1):
     :return:
     """
 
-    isect0_pos_x = int(isect0.name[1:2])
-    isect0_pos_y = int(isect0.name[2:3])
-
-    isect1_pos_x = int(isect1.name[1:2])
-    isect1_pos_y = int(isect1.name[2:3])
+    isect0_pos_x, isect0_pos_y = _grid_position(isect0.name)
+    isect1_pos_x, isect1_pos_y = _grid_position(isect1.name)
 
     return abs(isect0_pos_x - isect1_pos_x) + (isect0_pos_y - isect1_pos_y)
 
 
+def _grid_position(name):
+    """Gets the grid coordinates of an intersection from its name.
+
+    Names are "i{x}{y}", or "i{x}_{y}" on grids with 10 or more
+    intersections along a side (see create_random_roads_and_vehicles).
+
+    :param name: name of the intersection
+    :return: tuple of (x, y) grid coordinates
+    """
+
+    if "_" in name:
+        x, y = name[1:].split("_")
+        return int(x), int(y)
+
+    return int(name[1:2]), int(name[2:3])
+
+
 def _find_node_closest_to(intersection, neighbors, f_curr):
     """
     Find a node closest to a given intersection which
@@ -1,10 +1,15 @@
 """Contains code to run the simulations."""
+import math
 import os
 import time
 
 __author__ = 'Adam Morrissett', 'Steven M. Hernandez'
 
-from vanet_sim.evaluation import Evaluations
+from vanet_sim import checkpoint
+from vanet_sim.evaluation import Evaluations, EvaluationCounters, EvaluationWriter
+from vanet_sim.instrumentation import StepInstrumentation
+from vanet_sim.spatial_index import SpatialGrid
+from vanet_sim.vehicle_net import steps_without_interaction
 from vanet_sim.routing.routing_protocols import UrbanRoutingHops, UrbanRoutingIntersection, Epidemic, GyTar
 
 LOG_TO_FILE = True
@@ -12,98 +17,462 @@ URBAN_ROUTING_INT_STRING = "urban-int"
 URBAN_ROUTING_HOPS_STRING = "urban-hops"
 EPIDEMIC_ROUTING_STRING = "epidemic"
 GYTAR_ROUTING_STRING = "gytar"
+OBJECT_ENGINE_STRING = "object"
+REPORT_EVERY_STRING = "every"
+REPORT_ON_CHANGE_STRING = "on-change"
+REPORT_FINAL_STRING = "final"
+VECTORIZED_ENGINE_STRING = "vectorized"
+
+# Phases of Simulation.step, in the order they run
+STEP_PHASES = ("location", "neighbors", "routing", "forwarding", "evaluation")
+
+ROUTING_PROTOCOLS = {
+    URBAN_ROUTING_HOPS_STRING: UrbanRoutingHops,
+    URBAN_ROUTING_INT_STRING: UrbanRoutingIntersection,
+    EPIDEMIC_ROUTING_STRING: Epidemic,
+    GYTAR_ROUTING_STRING: GyTar,
+}
+
+
+def default_settings():
+    return {
+        "communication_radius": 45,
+        "protocol": {
+            # "type": URBAN_ROUTING_INT_STRING,
+            "type": URBAN_ROUTING_HOPS_STRING,
+            # "type": EPIDEMIC_ROUTING_STRING,
+            # "type": GYTAR_ROUTING_STRING,
+            "max_hops": 5,
+            "max_ints": 1,
+            "min_feed_ratio":0.1,
+            "forwarder_ttl": 5,
+        }
+    }
 
 
 class Simulation:
     """Performs a simulation."""
 
-    def __init__(self, d_time, road_map, vehicle_net):
+    def __init__(self, d_time, road_map, vehicle_net,
+                 engine=OBJECT_ENGINE_STRING, settings=None,
+                 experiment_storage=None, instrument=False, skip_idle=False):
         """Custom constructor that initializes parameters.
 
         :param d_time: simulation time resolution
         :param road_map: filepath of the road network config file
         :param vehicle_net: filepath of the vehicle network config file
+        :param engine: OBJECT_ENGINE_STRING to update each Vehicle in
+            turn, or VECTORIZED_ENGINE_STRING to update all vehicles at
+            once with NumPy (vehicle_net is then filled with views)
+        :param settings: dict overriding entries of default_settings();
+            a "protocol" entry only overrides the protocol keys it has
+        :param experiment_storage: directory to log the experiment to
+            (default: a new timestamped directory)
+        :param instrument: whether to time the phases of every step and
+            write them to phases.csv next to evaluation.csv (see
+            StepInstrumentation)
+        :param skip_idle: whether to skip the work of steps in which
+            nothing can be routed (see step()) and to jump over steps in
+            which no vehicle can interact (see run()); the metrics are
+            the same either way
         """
         self.cur_time = 0
+        self.num_steps = 0
         self.d_time = d_time
         self.road_net = road_map
         self.vehicle_net = vehicle_net
 
-        self.experiment_storage = "../storage/experiments/{}/".format(time.time())
-        os.makedirs(self.experiment_storage)
+        if engine == VECTORIZED_ENGINE_STRING:
+            # Imported here so NumPy is only needed by this engine
+            from vanet_sim.vectorized import VehicleArrays
+            self.engine = VehicleArrays(road_map, vehicle_net)
+        elif engine == OBJECT_ENGINE_STRING:
+            self.engine = None
+            self.road_net.index_vehicles(vehicle_net)
+        else:
+            raise ValueError("Unknown engine: {}".format(engine))
 
-        self.settings = {
-            "communication_radius": 45,
-            "protocol": {
-                # "type": URBAN_ROUTING_INT_STRING,
-                "type": URBAN_ROUTING_HOPS_STRING,
-                # "type": EPIDEMIC_ROUTING_STRING,
-                # "type": GYTAR_ROUTING_STRING,
-                "max_hops": 5,
-                "max_ints": 1,
-                "min_feed_ratio":0.1,
-                "forwarder_ttl": 5,
-            }
-        }
+        self.metrics = EvaluationCounters()
+        self.metrics.track(self.vehicle_net)
+
+        # Opened on the first logged step and closed at the end of run()
+        self.evaluation_writer = None
+        self.instrument = instrument
+        self.instrumentation = None
+
+        # Steps whose neighbors, routing and forwarding were skipped,
+        # and steps that were jumped over entirely
+        self.skip_idle = skip_idle
+        self.num_idle_steps = 0
+        self.num_skipped_steps = 0
+        self._idle = False
+
+        # How metrics are printed to the console (see run())
+        self.report = REPORT_EVERY_STRING
+        self.report_interval = 1
+        self._reported_metrics = None
+        self._last_metrics = None
+
+        self.settings = default_settings()
+        self._start_experiment(settings, experiment_storage)
+
+    def _start_experiment(self, settings, experiment_storage):
+        """Applies settings and creates the directory to log to.
+
+        :param settings: dict overriding entries of the current settings
+        :param experiment_storage: directory to log the experiment to
+            (default: a new timestamped directory)
+        :return: None
+        """
+
+        if settings is not None:
+            for key in settings:
+                if key == "protocol":
+                    self.settings["protocol"].update(settings["protocol"])
+                else:
+                    self.settings[key] = settings[key]
+
+        protocol_type = self.settings["protocol"]["type"]
+        if protocol_type not in ROUTING_PROTOCOLS:
+            raise ValueError("Unknown routing protocol: {}".format(protocol_type))
+        self.protocol = ROUTING_PROTOCOLS[protocol_type]()
+
+        if experiment_storage is None:
+            experiment_storage = "../storage/experiments/{}/".format(time.time())
+        self.experiment_storage = os.path.join(experiment_storage, "")
+        os.makedirs(self.experiment_storage)
 
         self.write_settings_to_file()
 
+    def save_checkpoint(self, filepath):
+        """Saves the full state of the simulation to a compressed file.
+
+        The state includes the road map, every vehicle with its route,
+        message and forwarder flags, the metrics, the current time and
+        the settings. Buffered log rows are written out first, and the
+        logs are reopened by the next logged step.
+
+        :param filepath: path to the checkpoint file
+        :return: None
+        """
+
+        self.close()
+
+        checkpoint.save(self, filepath)
+
+    @staticmethod
+    def load_checkpoint(filepath, settings=None, experiment_storage=None):
+        """Restores a simulation saved with save_checkpoint.
+
+        Any number of simulations can be restored from one checkpoint,
+        e.g. to run different protocols from the time of the incident
+        without simulating the time before it again.
+
+        :param filepath: path to the checkpoint file
+        :param settings: dict overriding entries of the saved settings;
+            a "protocol" entry only overrides the protocol keys it has
+        :param experiment_storage: directory to log the restored run to
+            (default: a new timestamped directory)
+        :return: Simulation continuing from the saved state
+        """
+
+        sim = checkpoint.load(filepath)
+        sim._start_experiment(settings, experiment_storage)
+
+        return sim
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+
+        # Open files and writer threads are not saved
+        state["evaluation_writer"] = None
+        state["instrumentation"] = None
+
+        return state
+
     def step(self):
-        """Progresses the simulation forward by one time derivative."""
+        """Progresses the simulation forward by one time derivative.
+
+        Each phase of STEP_PHASES has its own method (see phases()), so
+        that it can be measured on its own.
+
+        With skip_idle, a step is idle when there are no current
+        forwarders and no vehicle became affected while moving, as no
+        vehicle can then become a forwarder or receive the message. The
+        neighbors, routing and forwarding phases of idle steps do
+        nothing, so vehicle neighbor lists are only kept up to date
+        while the message is being routed. Once every vehicle is stopped
+        and no forwarder is left, nothing can change anymore and the
+        location phase is skipped too. The metrics are still calculated
+        and logged for every step.
+        """
+
+        if self.instrument:
+            if self.instrumentation is None:
+                self.instrumentation = StepInstrumentation(
+                    self.experiment_storage + "phases.csv")
+
+            self.instrumentation.step(self)
+            return
+
+        self._update_locations()
+        self._update_neighbors()
+        self._update_routing()
+        self._forward_message()
+        self._evaluate()
+
+        self.advance_time()
+
+    def phases(self):
+        """Gets the phases of a step in the order step() runs them.
+
+        Calling each method in turn and then advance_time() is the same
+        as calling step().
+
+        :return: List of (name from STEP_PHASES, method) tuples
+        """
+
+        return list(zip(STEP_PHASES, (self._update_locations,
+                                      self._update_neighbors,
+                                      self._update_routing,
+                                      self._forward_message,
+                                      self._evaluate)))
+
+    def advance_time(self):
+        self.cur_time += self.d_time
+        self.num_steps += 1
+
+    def _update_locations(self):
+        if self.skip_idle:
+            num_affected = self.metrics.num_affected
+
+            if (num_affected == len(self.vehicle_net)
+                    and not self._has_forwarders()):
+                # Stopped vehicles do not move
+                self._idle = True
+                self.num_idle_steps += 1
+                return
 
-        # Update vehicle locations first
-        for v in self.vehicle_net:
-            v.update_location(self.cur_time)
+        if self.engine is None:
+            for v in self.vehicle_net:
+                v.update_location(self.cur_time)
+        else:
+            self.engine.update_locations(self.cur_time)
 
-        # Collect list of neighbors
-        for v in self.vehicle_net:
-            v.update_neighbors(self.vehicle_net,
+        if self.skip_idle:
+            # Only vehicles affected during this step can become
+            # forwarders in the routing phase
+            self._idle = (self.metrics.num_affected == num_affected
+                          and not self._has_forwarders())
+            self.num_idle_steps += self._idle
+
+    def _has_forwarders(self):
+        if self.engine is None:
+            return any(v.is_cur_fwdr for v in self.vehicle_net)
+        else:
+            return bool(self.engine.is_cur_fwdr.any())
+
+    def _update_neighbors(self):
+        if self._idle:
+            return
+
+        if self.engine is None:
+            # Only vehicles in the surrounding grid cells can be in
+            # range, so each vehicle checks those.
+            grid = SpatialGrid(self.vehicle_net,
                                self.settings["communication_radius"])
 
-        # Update the routing state
-        for v in self.vehicle_net:
-            v.update_routing(self.cur_time)
-
-        # Find the current forwarders
-        cur_fwdrs = [v for v in self.vehicle_net if v.is_cur_fwdr]
-        # for v in self.vehicle_net:
-        #     if v.is_cur_fwdr:
-        #         current_forwarders.append(v)
-
-        # Route the message from the current forwarder
-        for cur_fwdr in cur_fwdrs:
-            protocols = {
-                URBAN_ROUTING_HOPS_STRING: UrbanRoutingHops,
-                URBAN_ROUTING_INT_STRING: UrbanRoutingIntersection,
-                EPIDEMIC_ROUTING_STRING: Epidemic,
-                GYTAR_ROUTING_STRING: GyTar,
-            }
-            protocol = protocols[self.settings["protocol"]["type"]]
-            protocol.route_message(protocol,
-                                   cur_fwdr,
-                                   self.settings["protocol"],
-                                   self.vehicle_net,
-                                   self.cur_time)
-
-        print(Evaluations.run(self.cur_time, self.vehicle_net))
+            for v in self.vehicle_net:
+                v.update_neighbors(grid.candidates(v),
+                                   self.settings["communication_radius"])
+        else:
+            self.engine.update_neighbors(self.settings["communication_radius"])
+
+    def _update_routing(self):
+        if self._idle:
+            return
+
+        if self.engine is None:
+            for v in self.vehicle_net:
+                v.update_routing(self.cur_time)
+        else:
+            self.engine.update_routing(self.cur_time)
+
+    def _forward_message(self):
+        """Routes the message from the current forwarders.
+
+        :return: List of current forwarders
+        """
+
+        if self._idle:
+            return []
+
+        if self.engine is None:
+            cur_fwdrs = [v for v in self.vehicle_net if v.is_cur_fwdr]
+        else:
+            cur_fwdrs = self.engine.current_forwarders()
+
+        self.protocol.route_all(cur_fwdrs,
+                                self.settings["protocol"],
+                                self.vehicle_net,
+                                self.cur_time)
+
+        return cur_fwdrs
+
+    def _evaluate(self):
+        """Calculates, reports and logs the metrics of the current step."""
+
+        metrics = self.metrics.calculate()
+
+        self._report_step(metrics)
 
         if LOG_TO_FILE:
-            Evaluations.write_to(self.experiment_storage,
-                                 self.cur_time,
-                                 self.vehicle_net)
+            if self.evaluation_writer is None:
+                self.evaluation_writer = EvaluationWriter(
+                    self.experiment_storage + "evaluation.csv")
 
-        self.cur_time += self.d_time
+            self.evaluation_writer.write(self.cur_time, metrics)
+
+    def _report_step(self, metrics):
+        """Prints the metrics of the current step if the report mode says so.
+
+        :param metrics: tuple from EvaluationCounters.calculate
+        :return: None
+        """
+
+        if self.report == REPORT_EVERY_STRING:
+            if self.num_steps % self.report_interval == 0:
+                print(Evaluations.format(self.cur_time, metrics))
+        elif self.report == REPORT_ON_CHANGE_STRING:
+            if metrics != self._reported_metrics:
+                print(Evaluations.format(self.cur_time, metrics))
+                self._reported_metrics = metrics
+
+        self._last_metrics = (self.cur_time, metrics)
 
-    def run(self, time_duration):
+    def run(self, time_duration, report=None, report_interval=None,
+            progress=None):
         """Executes the simulation for the specified duration.
 
         This is on top of previous simulation time.
+
+        :param time_duration: simulation time to run until
+        :param report: REPORT_EVERY_STRING to print the metrics every
+            report_interval steps, REPORT_ON_CHANGE_STRING to print them
+            only when they change, or REPORT_FINAL_STRING to print them
+            once at the end (default: keep the current mode, which is
+            every step unless changed)
+        :param report_interval: number of steps between reports in
+            REPORT_EVERY_STRING mode
+        :param progress: optional function called after every step as
+            progress(cur_time, time_duration, metrics)
+
+        With skip_idle, whenever there are no current forwarders the
+        coming steps in which no vehicle can interact with another are
+        jumped over: no vehicle gets within the following distance of
+        another or reaches the obstruction or the end of its road, so
+        each one just keeps moving at its speed and no metric can
+        change. The vehicles are moved to the last of those steps at
+        once, and the unchanged metrics are still reported and logged
+        for every step. Jumped steps are counted in num_skipped_steps
+        and have no row in phases.csv.
+        """
+
+        if report is not None:
+            if report not in (REPORT_EVERY_STRING, REPORT_ON_CHANGE_STRING,
+                              REPORT_FINAL_STRING):
+                raise ValueError("Unknown report mode: {}".format(report))
+            self.report = report
+
+        if report_interval is not None:
+            self.report_interval = report_interval
+
+        # The quieter report modes only print metrics
+        if self.report == REPORT_EVERY_STRING:
+            print(f'Starting simulation from t = {self.cur_time:.3f}')
+
+        try:
+            while self.cur_time < time_duration:
+                num_steps = self._free_steps(time_duration)
+
+                if num_steps:
+                    self._skip_steps(num_steps, time_duration, progress)
+                    continue
+
+                self.step()
+
+                if progress is not None:
+                    progress(self.cur_time, time_duration,
+                             self._last_metrics[1])
+        finally:
+            self.close()
+
+        if self.report == REPORT_FINAL_STRING and self._last_metrics is not None:
+            print(Evaluations.format(*self._last_metrics))
+
+    def _free_steps(self, time_duration):
+        """Counts the coming steps that can be jumped over (see run()).
+
+        :param time_duration: simulation time to run until
+        :return: number of steps, 0 without skip_idle
+        """
+
+        if not self.skip_idle or self._has_forwarders():
+            return 0
+
+        max_steps = math.ceil((time_duration - self.cur_time) / self.d_time)
+
+        if self.engine is None:
+            return steps_without_interaction(self.vehicle_net, self.d_time,
+                                             max_steps)
+        else:
+            return self.engine.steps_without_interaction(self.d_time,
+                                                         max_steps)
+
+    def _skip_steps(self, num_steps, time_duration, progress):
+        """Jumps over steps in which no vehicle can interact.
+
+        :param num_steps: number of steps from _free_steps
+        :param time_duration: simulation time to run until
+        :param progress: progress function passed to run()
+        :return: None
+        """
+
+        # Same additions as advance_time, so the times match exactly
+        times = []
+        t = self.cur_time
+
+        while len(times) < num_steps and t < time_duration:
+            times.append(t)
+            t += self.d_time
+
+        if self.engine is None:
+            for v in self.vehicle_net:
+                v.move_freely(times)
+        else:
+            self.engine.move_freely(times)
+
+        for _ in times:
+            self._evaluate()
+            self.advance_time()
+            self.num_skipped_steps += 1
+
+            if progress is not None:
+                progress(self.cur_time, time_duration, self._last_metrics[1])
+
+    def close(self):
+        """Writes out any buffered rows and closes the evaluation logs.
+
+        Stepping again afterwards reopens the logs and appends to them.
         """
 
-        print(f'Starting simulation from t = {self.cur_time:.3f}')
+        if self.evaluation_writer is not None:
+            self.evaluation_writer.close()
+            self.evaluation_writer = None
 
-        while self.cur_time < time_duration:
-            self.step()
+        if self.instrumentation is not None:
+            self.instrumentation.close()
+            self.instrumentation = None
 
     def write_settings_to_file(self):
         if LOG_TO_FILE:
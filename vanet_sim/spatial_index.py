@@ -0,0 +1,66 @@
+"""Contains a uniform grid spatial index for neighbor discovery."""
+
+__author__ = 'Adam Morrissett', 'Steven M. Hernandez'
+
+
+import math
+
+
+class SpatialGrid:
+    """Buckets vehicles into square cells of one communication radius.
+
+    Any vehicle closer than the communication radius to a given vehicle
+    must sit in the same cell or one of the eight cells around it, so
+    neighbor queries only have to look at those nine buckets instead
+    of the whole vehicle network.
+    """
+
+    def __init__(self, vehicle_net, cell_size):
+        """Custom constructor that buckets every vehicle by position.
+
+        :param vehicle_net: List of vehicles to index
+        :param cell_size: width of a grid cell (communication radius)
+        """
+
+        self.cell_size = cell_size
+        self.cells = {}
+
+        # Remember each vehicle's position in the network so query
+        # results come back in the same order as a full network scan.
+        self._order = {}
+
+        for i, v in enumerate(vehicle_net):
+            self._order[v.id] = i
+            key = self._cell_of(v.x, v.y)
+
+            if key not in self.cells:
+                self.cells[key] = []
+            self.cells[key].append(v)
+
+    def _cell_of(self, x, y):
+        return (math.floor(x / self.cell_size),
+                math.floor(y / self.cell_size))
+
+    def candidates(self, vehicle):
+        """Gets the vehicles that could be within range of a vehicle.
+
+        The returned List is a superset of the vehicle's neighbors (it
+        includes the vehicle itself) ordered as in the vehicle network.
+
+        :param vehicle: vehicle of interest
+        :return: List of vehicles in the surrounding 3x3 block of cells
+        """
+
+        c_x, c_y = self._cell_of(vehicle.x, vehicle.y)
+        ret_list = []
+
+        for d_x in (-1, 0, 1):
+            for d_y in (-1, 0, 1):
+                cell = self.cells.get((c_x + d_x, c_y + d_y))
+
+                if cell is not None:
+                    ret_list.extend(cell)
+
+        ret_list.sort(key=lambda v: self._order[v.id])
+
+        return ret_list
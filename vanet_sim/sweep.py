@@ -0,0 +1,229 @@
+"""Contains code to run parameter sweeps across CPU cores."""
+
+__author__ = 'Adam Morrissett', 'Steven M. Hernandez'
+
+
+import concurrent.futures
+import contextlib
+import itertools
+import os
+import time
+import traceback
+
+from vanet_sim import simulation, vehicle_net, road_net
+
+# Sweep keys that belong in the "protocol" section of the settings
+PROTOCOL_KEYS = ("type", "max_hops", "max_ints", "min_feed_ratio",
+                 "forwarder_ttl")
+
+SUMMARY_CSV_HEADER = ("run,vehicle_file,communication_radius,type,max_hops,"
+                      "max_ints,min_feed_ratio,forwarder_ttl,num_affected,"
+                      "num_received,num_affected_and_received,"
+                      "avg_time_to_react,wall_time,error\n")
+
+
+def expand_grid(grid):
+    """Builds every combination of the values in a settings grid.
+
+    :param grid: dict of setting name to List of values to try, e.g.
+        {"type": ["urban-hops", "epidemic"], "max_hops": [3, 5]}.
+        Keys here are "vehicle_file", "communication_radius" or one of
+        PROTOCOL_KEYS.
+    :return: List of dicts with one value per setting
+    """
+
+    keys = list(grid)
+
+    return [dict(zip(keys, values))
+            for values in itertools.product(*(grid[k] for k in keys))]
+
+
+def run_scenario(scenario):
+    """Runs one simulation of a sweep.
+
+    The simulation only reports its final metrics, and everything it
+    prints is sent to output.txt in the run directory. If the run fails,
+    its traceback goes there too and the run has no metrics, so one
+    failing run does not stop the other runs of a sweep.
+
+    :param scenario: dict with "intersection_file", "road_file",
+        "vehicle_file", "d_time", "time_duration", "engine",
+        "experiment_storage" and the swept settings, or with
+        "checkpoint" instead of the files, d_time and engine to continue
+        a saved simulation (see Simulation.save_checkpoint)
+    :return: dict of the scenario and its final evaluation metrics
+    """
+
+    settings = {"protocol": {}}
+
+    for key in scenario:
+        if key in PROTOCOL_KEYS:
+            settings["protocol"][key] = scenario[key]
+        elif key == "communication_radius":
+            settings[key] = scenario[key]
+
+    start = time.time()
+    os.makedirs(scenario["experiment_storage"])
+    experiment_storage = os.path.join(scenario["experiment_storage"],
+                                      "simulation")
+
+    # Settings of the run if it fails before the simulation has them
+    run_settings = simulation.default_settings()
+    run_settings["protocol"].update(settings["protocol"])
+    if "communication_radius" in settings:
+        run_settings["communication_radius"] = settings["communication_radius"]
+
+    metrics = (None, None, None, None)
+    error = None
+
+    with open(os.path.join(scenario["experiment_storage"], "output.txt"),
+              "w") as fp, contextlib.redirect_stdout(fp):
+        try:
+            if scenario.get("checkpoint") is not None:
+                sim = simulation.Simulation.load_checkpoint(
+                    scenario["checkpoint"],
+                    settings=settings,
+                    experiment_storage=experiment_storage)
+            else:
+                road_map = road_net.RoadMap(
+                    intersection_file=scenario["intersection_file"],
+                    road_file=scenario["road_file"])
+
+                vehicles = vehicle_net.build_vehicle_net(
+                    filepath=scenario["vehicle_file"], road_map=road_map)
+
+                sim = simulation.Simulation(
+                    d_time=scenario["d_time"],
+                    road_map=road_map,
+                    vehicle_net=vehicles,
+                    engine=scenario["engine"],
+                    settings=settings,
+                    experiment_storage=experiment_storage)
+
+            run_settings = sim.settings
+            sim.run(time_duration=scenario["time_duration"],
+                    report=simulation.REPORT_FINAL_STRING)
+            metrics = sim.metrics.calculate()
+        except Exception as e:
+            traceback.print_exc(file=fp)
+            error = repr(e)
+
+    num_affected, num_received, num_affected_and_received, avg_time_to_react = \
+        metrics
+
+    result = dict(scenario)
+    result["settings"] = run_settings
+    result["num_affected"] = num_affected
+    result["num_received"] = num_received
+    result["num_affected_and_received"] = num_affected_and_received
+    result["avg_time_to_react"] = avg_time_to_react
+    result["wall_time"] = time.time() - start
+    result["error"] = error
+
+    return result
+
+
+def run_sweep(grid, intersection_file, road_file, time_duration, d_time=0.5,
+              engine=simulation.OBJECT_ENGINE_STRING,
+              storage="storage/experiments/", processes=None,
+              checkpoint=None):
+    """Runs every combination of a settings grid in a process pool.
+
+    Each run is logged to its own numbered directory inside a new sweep
+    directory, next to a summary.csv with one line per run.
+
+    Given a checkpoint, every run continues the saved simulation instead
+    of starting from the files, so the time before it (e.g. until the
+    incident) is only simulated once for the whole sweep.
+
+    :param grid: settings grid (see expand_grid), which must include
+        "vehicle_file" unless a checkpoint is given
+    :param intersection_file: path to the intersections file (unused
+        with a checkpoint)
+    :param road_file: path to the roads file (unused with a checkpoint)
+    :param time_duration: simulated time to run each run until
+    :param d_time: simulation time resolution
+    :param engine: simulation engine of each run
+    :param storage: directory in which to create the sweep directory
+    :param processes: number of worker processes (default: CPU count)
+    :param checkpoint: path to a file saved by Simulation.save_checkpoint
+        to start every run from (d_time and engine are then the saved
+        ones)
+    :return: List of run results ordered like expand_grid(grid)
+    """
+
+    combinations = expand_grid(grid)
+
+    for combination in combinations:
+        protocol_type = combination.get("type")
+        if (protocol_type is not None
+                and protocol_type not in simulation.ROUTING_PROTOCOLS):
+            raise ValueError("Unknown routing protocol: {}".format(protocol_type))
+
+    sweep_storage = os.path.join(storage, "sweep-{}".format(time.time()))
+    os.makedirs(sweep_storage)
+
+    scenarios = []
+
+    for i, combination in enumerate(combinations):
+        scenario = dict(combination)
+        scenario["intersection_file"] = intersection_file
+        scenario["road_file"] = road_file
+        scenario["d_time"] = d_time
+        scenario["time_duration"] = time_duration
+        scenario["engine"] = engine
+        scenario["checkpoint"] = checkpoint
+        scenario["experiment_storage"] = os.path.join(sweep_storage,
+                                                      "{:04d}".format(i))
+        scenarios.append(scenario)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as pool:
+        results = list(pool.map(run_scenario, scenarios))
+
+    write_summary(os.path.join(sweep_storage, "summary.csv"), results)
+
+    return results
+
+
+def summary_row(r):
+    """Gets the values of the summary line of a run.
+
+    :param r: dict returned by run_scenario
+    :return: List of values in SUMMARY_CSV_HEADER order
+    """
+
+    protocol = r["settings"]["protocol"]
+
+    return [
+        os.path.basename(r["experiment_storage"]),
+        r.get("vehicle_file", ""),
+        r["settings"]["communication_radius"],
+        protocol["type"],
+        protocol["max_hops"],
+        protocol["max_ints"],
+        protocol["min_feed_ratio"],
+        protocol["forwarder_ttl"],
+        r["num_affected"],
+        r["num_received"],
+        r["num_affected_and_received"],
+        r["avg_time_to_react"],
+        r["wall_time"],
+        # Quoted, since the message may contain commas
+        "" if r["error"] is None
+        else '"{}"'.format(r["error"].replace('"', '""')),
+    ]
+
+
+def write_summary(filepath, results):
+    """Writes one CSV line per run with its settings and final metrics.
+
+    :param filepath: path to the summary file
+    :param results: List of dicts returned by run_scenario
+    :return: None
+    """
+
+    with open(filepath, "w") as f:
+        f.write(SUMMARY_CSV_HEADER)
+
+        for r in results:
+            f.write(",".join(str(x) for x in summary_row(r)) + "\n")
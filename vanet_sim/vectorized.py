@@ -0,0 +1,696 @@
+"""Contains a struct-of-arrays engine that steps every vehicle at once.
+
+Vehicle state lives in NumPy arrays indexed by a vehicle's position in
+the vehicle network. The Vehicle objects handed to routing protocols
+and the GUI are replaced by thin views that read and write those
+arrays, so the rest of the simulator does not need to know which
+engine is running.
+
+Vehicles are moved as if one after another in network order, as in the
+object engine (see VehicleArrays.update_locations), so both engines give
+the same results.
+"""
+
+__author__ = 'Adam Morrissett', 'Steven M. Hernandez'
+
+
+import numpy as np
+
+from vanet_sim import road_net
+from vanet_sim.routing.routing_protocols import Message
+from vanet_sim.vehicle_net import Vehicle
+
+# Offset separating the two cell coordinates packed in one grid key
+_CELL_KEY_STRIDE = 1 << 32
+
+
+class VehicleArrays:
+    """Holds the state of every vehicle in NumPy arrays."""
+
+    def __init__(self, road_map, vehicle_net):
+        """Custom constructor that copies vehicle state into arrays.
+
+        The vehicle network List is modified in place: each Vehicle is
+        replaced by a VehicleView of the same vehicle.
+
+        :param road_map: graph of the road network
+        :param vehicle_net: List of Vehicle objects
+        """
+
+        # Road table
+        self.roads = list(road_map.road_dict.values())
+        road_ids = {r.name: i for i, r in enumerate(self.roads)}
+
+        self.road_length = np.array([r.length for r in self.roads])
+        self.road_spd_lim = np.array([r.spd_lim for r in self.roads])
+        self.road_is_obstructed = np.array([r.is_obstructed
+                                            for r in self.roads])
+        self.road_obstruction_pos = np.array([r.obstruction_pos
+                                              for r in self.roads])
+        self.road_start_x = np.array([r.start_node.x_pos for r in self.roads])
+        self.road_start_y = np.array([r.start_node.y_pos for r in self.roads])
+        self.road_end_x = np.array([r.end_node.x_pos for r in self.roads])
+        self.road_end_y = np.array([r.end_node.y_pos for r in self.roads])
+
+        # Nearby roads (see Road.nearby_roads) as sorted keys of
+        # road * number of roads + nearby road, with their ranges
+        nearby = sorted((road_ids[r0.name] * len(self.roads) + road_ids[r1.name],
+                         lo, hi)
+                        for r0 in self.roads for r1, lo, hi in r0.nearby_roads)
+        self.nearby_key = np.array([n[0] for n in nearby], dtype=np.int64)
+        self.nearby_lo = np.array([n[1] for n in nearby], dtype=float)
+        self.nearby_hi = np.array([n[2] for n in nearby], dtype=float)
+
+        # Routes are flattened into one array of road indices
+        route_len = [len(v.route) for v in vehicle_net]
+        self.route_len = np.array(route_len, dtype=np.int64)
+        self.route_start = np.concatenate(([0], np.cumsum(route_len)[:-1]))
+        self.route_roads = np.array([road_ids[r.name]
+                                     for v in vehicle_net for r in v.route],
+                                    dtype=np.int64)
+
+        # Vehicle state
+        self.vehicle_id = np.array([v.id for v in vehicle_net])
+        self.route_index = np.array([v.route_index for v in vehicle_net],
+                                    dtype=np.int64)
+        self.road = np.array([road_ids[v.cur_road.name] for v in vehicle_net],
+                             dtype=np.int64)
+        self.spd = np.array([v.spd for v in vehicle_net], dtype=float)
+        self.cur_pos = np.array([v.cur_pos for v in vehicle_net], dtype=float)
+        self.x = np.array([v.x for v in vehicle_net], dtype=float)
+        self.y = np.array([v.y for v in vehicle_net], dtype=float)
+        self.prev_time = np.array([v.prev_time for v in vehicle_net],
+                                  dtype=float)
+        self.at_intersection = np.array([v.at_intersection
+                                         for v in vehicle_net])
+        self.is_cur_fwdr = np.array([v.is_cur_fwdr for v in vehicle_net])
+        self.affected_at = _to_array([v.affected_at for v in vehicle_net])
+        self.received_at = _to_array([v.received_at for v in vehicle_net])
+        self.passed_previous_intersection_at = _to_array(
+            [v.passed_previous_intersection_at for v in vehicle_net])
+
+        # EvaluationCounters shared by all views (see VehicleView.metrics)
+        self.metrics = None
+
+        self.views = [VehicleView(self, i, v)
+                      for i, v in enumerate(vehicle_net)]
+        vehicle_net[:] = self.views
+
+        # Neighbor lookups are answered lazily, at most once per step
+        # and vehicle. Lists of the current forwarders are found in one
+        # batch since the routing protocols ask for all of them.
+        self._communication_radius = None
+        self._grid = None
+        self._neighbors = {}
+
+    def update_locations(self, time):
+        """Vectorized equivalent of Vehicle.update_location.
+
+        The object engine moves vehicles one after another, so each one
+        sees the vehicles before it in the network already moved and
+        the ones after it not moved yet. The moves are found the same
+        way here: every vehicle first plans its move as if no other
+        vehicle had moved, and then the vehicles that follow an earlier
+        vehicle whose planned move changed plan again, until no planned
+        move changes. A vehicle's move only depends on the moves of the
+        vehicles before it, so these are exactly the object engine's
+        moves.
+
+        :param time: current simulation time
+        :return: None
+        """
+
+        n = len(self.x)
+
+        # Affected vehicles stay where they are
+        moving = np.isnan(self.affected_at)
+
+        # Planned move of every vehicle
+        d_pos = (time - self.prev_time) * self.spd
+        stopped = np.zeros(n, dtype=bool)
+        next_road = np.zeros(n, dtype=bool)
+
+        # Vehicle states before their move (indices below n) and after
+        # their planned move (indices n and up)
+        state = [np.concatenate((a, a)) for a in (self.road, self.cur_pos,
+                                                  self.x, self.y,
+                                                  ~moving)]
+
+        todo = np.flatnonzero(moving)
+
+        if not len(todo):
+            return
+
+        # No vehicle moves further than max_move, so these pairs include
+        # every vehicle that can be closer than the following distance
+        # before or after its move. The extra meter covers rounding.
+        max_move = d_pos[todo].max()
+        pairs = pairs_within(self.x, self.y,
+                             road_net.FOLLOWING_DISTANCE + max_move + 1,
+                             sources=todo)[:2]
+
+        while len(todo):
+            d_pos[todo], stopped[todo], next_road[todo] = \
+                self._plan_moves(todo, time, state, pairs)
+
+            planned = self._planned_states(todo, d_pos[todo], stopped[todo],
+                                           next_road[todo])
+            changed = np.zeros(n, dtype=bool)
+
+            for a, b in zip(state, planned):
+                changed[todo] |= a[n + todo] != b
+                a[n + todo] = b
+
+            # Only later vehicles close to a changed vehicle can see it
+            i, j = pairs
+            todo = np.unique(i[changed[j] & (i > j)])
+
+        road = self.road
+
+        self.spd[stopped] = 0
+        self._set_times(self.affected_at, np.flatnonzero(stopped), time)
+
+        # Move vehicles reaching the end of their road onto the next
+        # road of their route (wrapping around at the end).
+        d_pos[next_road] -= self.road_length[road[next_road]]
+        self.route_index[next_road] = ((self.route_index[next_road] + 1)
+                                       % self.route_len[next_road])
+        self.road[next_road] = self.route_roads[
+            self.route_start[next_road] + self.route_index[next_road]]
+        self.passed_previous_intersection_at[next_road] = time
+        self.spd[next_road] = self.road_spd_lim[self.road[next_road]]
+
+        self.cur_pos[moving] += d_pos[moving]
+        self._update_coordinates(moving)
+
+        self.prev_time[moving] = time
+
+    def _plan_moves(self, sources, time, state, pairs):
+        """Plans the moves of vehicles as Vehicle.update_location would.
+
+        :param sources: indices of the moving vehicles to plan for
+        :param time: current simulation time
+        :param state: List of the road, cur_pos, x, y and affected
+            arrays of every vehicle before (indices below the number of
+            vehicles) and after (the others) its planned move
+        :param pairs: tuple of arrays (vehicle, other vehicle) of every
+            moving vehicle and the vehicles that can be close to it
+        :return: tuple of arrays (distance to move, whether the vehicle
+            stops, whether it moves onto its next road)
+        """
+
+        road = self.road[sources]
+        cur_pos = self.cur_pos[sources]
+
+        d_pos = (time - self.prev_time[sources]) * self.spd[sources]
+        fwd_n, fwd_dist = self._forward_neighbors(sources, pairs, *state[:4])
+
+        slowed = ((fwd_n >= 0)
+                  & (d_pos > fwd_dist - road_net.FOLLOWING_DISTANCE)
+                  & (time > 5))
+        d_pos = np.where(slowed, d_pos * 0.5, d_pos)
+
+        fwd_affected = np.zeros_like(slowed)
+        fwd_affected[slowed] = state[4][fwd_n[slowed]]
+        stopped_behind = slowed & (self.road_is_obstructed[road]
+                                   | fwd_affected)
+
+        stopped_at_obstruction = (
+            ~slowed & self.road_is_obstructed[road]
+            & (cur_pos + d_pos >= self.road_obstruction_pos[road]))
+        d_pos[stopped_at_obstruction] = 0
+
+        next_road = cur_pos + d_pos >= self.road_length[road]
+
+        return d_pos, stopped_behind | stopped_at_obstruction, next_road
+
+    def _planned_states(self, sources, d_pos, stopped, next_road):
+        """Gets the states planned moves lead to, as update_locations.
+
+        :param sources: indices of the vehicles
+        :param d_pos: distances they move
+        :param stopped: whether they stop
+        :param next_road: whether they move onto their next road
+        :return: List of the road, cur_pos, x, y and affected arrays
+        """
+
+        road = self.road[sources].copy()
+        d_pos = d_pos.copy()
+        d_pos[next_road] -= self.road_length[road[next_road]]
+        road[next_road] = self.route_roads[
+            self.route_start[sources[next_road]]
+            + (self.route_index[sources[next_road]] + 1)
+            % self.route_len[sources[next_road]]]
+        cur_pos = self.cur_pos[sources] + d_pos
+
+        x_range = self.road_end_x[road] - self.road_start_x[road]
+        y_range = self.road_end_y[road] - self.road_start_y[road]
+        x = (self.road_start_x[road]
+             + (x_range * cur_pos / self.road_length[road]))
+        y = (self.road_start_y[road]
+             + (y_range * cur_pos / self.road_length[road]))
+
+        return [road, cur_pos, x, y, stopped]
+
+    def steps_without_interaction(self, d_time, max_steps):
+        """Vectorized equivalent of vehicle_net.steps_without_interaction.
+
+        :param d_time: simulation time resolution
+        :param max_steps: maximum number of steps to look ahead
+        :return: number of steps (0 when the next one may interact)
+        """
+
+        moving = np.flatnonzero(np.isnan(self.affected_at) & (self.spd > 0))
+
+        if not len(moving):
+            # Nothing moves anymore
+            return max_steps
+
+        road = self.road[moving]
+        limit = np.where(self.road_is_obstructed[road],
+                         np.minimum(self.road_length[road],
+                                    self.road_obstruction_pos[road]),
+                         self.road_length[road])
+        spd = self.spd[moving]
+        num_steps = min(max_steps, int(np.floor(
+            (limit - self.cur_pos[moving]) / (spd * d_time)).min()) - 1)
+
+        if num_steps <= 0:
+            return 0
+
+        # Vehicles further apart than this cannot get close enough in time
+        i, j, dist = pairs_within(self.x, self.y,
+                                  road_net.FOLLOWING_DISTANCE
+                                  + 2 * spd.max() * (num_steps + 1) * d_time,
+                                  sources=moving)
+
+        if len(i):
+            num_steps = min(num_steps, int(np.floor(
+                (dist - road_net.FOLLOWING_DISTANCE)
+                / ((self.spd[i] + self.spd[j]) * d_time)).min()) - 1)
+
+        return max(num_steps, 0)
+
+    def move_freely(self, times):
+        """Vectorized equivalent of Vehicle.move_freely.
+
+        :param times: simulation times of the skipped steps, in order
+        :return: None
+        """
+
+        moving = np.isnan(self.affected_at)
+
+        for time in times:
+            self.cur_pos[moving] += ((time - self.prev_time[moving])
+                                     * self.spd[moving])
+            self.prev_time[moving] = time
+
+        self._update_coordinates(moving)
+
+    def _update_coordinates(self, moving):
+        road = self.road
+        self.at_intersection[moving] = (self.cur_pos[moving]
+                                        <= road_net.INTERSECTION_RADIUS * 3)
+
+        x_range = self.road_end_x[road] - self.road_start_x[road]
+        y_range = self.road_end_y[road] - self.road_start_y[road]
+        x = (self.road_start_x[road]
+             + (x_range * self.cur_pos / self.road_length[road]))
+        y = (self.road_start_y[road]
+             + (y_range * self.cur_pos / self.road_length[road]))
+        self.x[moving] = x[moving]
+        self.y[moving] = y[moving]
+
+    def update_neighbors(self, communication_radius):
+        """Finds the neighbors of the current forwarders for this step.
+
+        The neighbors of other vehicles (e.g. forwarders added later in
+        the step) are still found when neighbors_of first asks for them.
+
+        :param communication_radius: communication radius of vehicles
+        :return: None
+        """
+
+        self._communication_radius = communication_radius
+        self._grid = None
+        self._neighbors = {}
+
+        self._find_forwarder_neighbors()
+
+    def _forward_neighbors(self, sources, pairs, road, cur_pos, x, y):
+        """Finds the vehicle immediately in front of the given vehicles.
+
+        Uses the same definition of "in front" as
+        Vehicle._get_forward_neighbor: a vehicle further along the same
+        road, or one on a nearby road whose position is within the
+        following distance of our projection onto that road and behind
+        our own position.
+
+        As in the object engine, each vehicle sees the vehicles before
+        it in the network after their move and the ones after it before
+        their move.
+
+        :param sources: indices of the vehicles of interest
+        :param pairs: tuple of arrays (vehicle, other vehicle) including
+            every vehicle that can be in front of a source
+        :param road: road of every vehicle before its move (indices
+            below the number of vehicles) and after it (the others)
+        :param cur_pos: positions, indexed like road
+        :param x: x positions, indexed like road
+        :param y: y positions, indexed like road
+        :return: tuple of arrays aligned with sources (index like road
+            of forward neighbor or -1, distance to forward neighbor)
+        """
+
+        n = len(self.x)
+        fwd_n = np.full(n, -1, dtype=np.int64)
+        fwd_dist = np.full(n, np.inf)
+
+        is_source = np.zeros(n, dtype=bool)
+        is_source[sources] = True
+        i, j = pairs
+        i, j = i[is_source[i]], j[is_source[i]]
+        j = np.where(j > i, j, j + n)
+
+        # Same arithmetic as vehicle_net._calc_distance
+        dist = np.sqrt((x[j] - x[i]) ** 2 + (y[j] - y[i]) ** 2)
+        close = dist < road_net.FOLLOWING_DISTANCE
+        i, j, dist = i[close], j[close], dist[close]
+
+        road_i = road[i]
+        road_j = road[j]
+        pos_i = cur_pos[i]
+        pos_j = cur_pos[j]
+        same_road = road_i == road_j
+
+        is_ahead = (same_road & (pos_i < pos_j)
+                    & (pos_j < pos_i + road_net.FOLLOWING_DISTANCE))
+
+        if len(self.nearby_key):
+            key = road_i * len(self.roads) + road_j
+            k = np.minimum(np.searchsorted(self.nearby_key, key),
+                           len(self.nearby_key) - 1)
+            nearby = (~same_road & (self.nearby_key[k] == key)
+                      & (self.nearby_lo[k] < pos_i)
+                      & (pos_i < self.nearby_hi[k]))
+
+            # Same arithmetic as Road.project
+            x_range = self.road_end_x[road_j] - self.road_start_x[road_j]
+            y_range = self.road_end_y[road_j] - self.road_start_y[road_j]
+            proj = (((x[i] - self.road_start_x[road_j]) * x_range
+                     + (y[i] - self.road_start_y[road_j]) * y_range)
+                    / self.road_length[road_j])
+
+            is_ahead |= (nearby
+                         & (proj - road_net.FOLLOWING_DISTANCE < pos_j)
+                         & (pos_j < np.minimum(
+                             proj + road_net.FOLLOWING_DISTANCE, pos_i)))
+
+        i, j, dist = i[is_ahead], j[is_ahead], dist[is_ahead]
+
+        # Closest vehicle ahead wins, ties going to the lower vehicle ID
+        order = np.lexsort((self.vehicle_id[j % n], dist, i))
+        i, j, dist = i[order], j[order], dist[order]
+        first = np.flatnonzero(np.r_[True, i[1:] != i[:-1]]) if len(i) else i
+
+        fwd_n[i[first]] = j[first]
+        fwd_dist[i[first]] = dist[first]
+
+        return fwd_n[sources], fwd_dist[sources]
+
+    def update_routing(self, time):
+        """Vectorized equivalent of Vehicle.update_routing.
+
+        :param time: current simulation time
+        :return: None
+        """
+
+        originators = np.flatnonzero((self.affected_at == time)
+                                     & np.isnan(self.received_at))
+
+        self.is_cur_fwdr[originators] = True
+        self._set_times(self.received_at, originators, time)
+
+        for k in originators:
+            cur_road = self.roads[self.road[k]]
+            self.views[k].msg = Message(src_rd=cur_road,
+                                        dst_isect=cur_road.start_node)
+
+    def current_forwarders(self):
+        return [self.views[k] for k in np.flatnonzero(self.is_cur_fwdr)]
+
+    def neighbors_of(self, k):
+        """Gets the neighbors of a vehicle at the current step.
+
+        :param k: index of the vehicle in the vehicle network
+        :return: List of neighboring VehicleViews in network order
+        """
+
+        if self._communication_radius is None:
+            return []
+
+        if not self._neighbors:
+            self._find_forwarder_neighbors()
+
+        if k not in self._neighbors:
+            if self._grid is None:
+                self._grid = _Grid(self.x, self.y,
+                                   self._communication_radius)
+
+            candidates = self._grid.candidates(self.x[k], self.y[k])
+            dist = np.sqrt((self.x[candidates] - self.x[k]) ** 2
+                           + (self.y[candidates] - self.y[k]) ** 2)
+            in_range = candidates[(dist < self._communication_radius)
+                                  & (candidates != k)]
+
+            self._neighbors[k] = [self.views[m] for m in np.sort(in_range)]
+
+        return self._neighbors[k]
+
+    def _find_forwarder_neighbors(self):
+        """Finds the neighbor lists of all current forwarders at once."""
+
+        fwdrs = np.flatnonzero(self.is_cur_fwdr)
+        i, j, _ = pairs_within(self.x, self.y, self._communication_radius,
+                                sources=fwdrs)
+
+        order = np.lexsort((j, i))
+        i, j = i[order], j[order]
+        bounds = np.searchsorted(i, fwdrs, side='left')
+        ends = np.searchsorted(i, fwdrs, side='right')
+
+        for k, a, b in zip(fwdrs, bounds, ends):
+            self._neighbors[k] = [self.views[m] for m in j[a:b]]
+
+    def _set_times(self, times, indices, time):
+        """Sets affected_at or received_at of some vehicles.
+
+        Only the vehicles that change are reported to the evaluation
+        counters, if any are tracking the network.
+
+        :param times: self.affected_at or self.received_at
+        :param indices: indices of the vehicles to update
+        :param time: value to set
+        :return: None
+        """
+
+        if self.metrics is None:
+            times[indices] = time
+            return
+
+        for k in indices:
+            self.metrics.remove(self.views[k])
+            times[k] = time
+            self.metrics.add(self.views[k])
+
+
+class VehicleView(Vehicle):
+    """Vehicle whose state is stored in a VehicleArrays engine."""
+
+    __slots__ = ('_engine', '_index')
+
+    def __init__(self, engine, index, vehicle):
+        """Custom constructor for VehicleView.
+
+        :param engine: VehicleArrays holding the vehicle state
+        :param index: index of the vehicle in the engine arrays
+        :param vehicle: Vehicle whose remaining attributes are copied
+        """
+
+        self._engine = engine
+        self._index = index
+
+        self.id = vehicle.id
+        self.route = vehicle.route
+        self.route_road_index = vehicle.route_road_index
+        self.congestion_detected = vehicle.congestion_detected
+        self.dest_intersection = vehicle.dest_intersection
+        self.msg = vehicle.msg
+
+    @property
+    def metrics(self):
+        return self._engine.metrics
+
+    @metrics.setter
+    def metrics(self, val):
+        self._engine.metrics = val
+
+    @property
+    def route_index(self):
+        return int(self._engine.route_index[self._index])
+
+    @property
+    def cur_road(self):
+        return self._engine.roads[self._engine.road[self._index]]
+
+    @property
+    def neighbors(self):
+        return self._engine.neighbors_of(self._index)
+
+    @property
+    def spd(self):
+        return float(self._engine.spd[self._index])
+
+    @property
+    def cur_pos(self):
+        return float(self._engine.cur_pos[self._index])
+
+    @property
+    def x(self):
+        return float(self._engine.x[self._index])
+
+    @property
+    def y(self):
+        return float(self._engine.y[self._index])
+
+    @property
+    def prev_time(self):
+        return float(self._engine.prev_time[self._index])
+
+    @property
+    def at_intersection(self):
+        return bool(self._engine.at_intersection[self._index])
+
+    @property
+    def is_cur_fwdr(self):
+        return bool(self._engine.is_cur_fwdr[self._index])
+
+    @is_cur_fwdr.setter
+    def is_cur_fwdr(self, val):
+        self._engine.is_cur_fwdr[self._index] = val
+
+    @property
+    def affected_at(self):
+        return _from_array(self._engine.affected_at[self._index])
+
+    @affected_at.setter
+    def affected_at(self, val):
+        self._engine._set_times(self._engine.affected_at, [self._index],
+                                _to_float(val))
+
+    @property
+    def received_at(self):
+        return _from_array(self._engine.received_at[self._index])
+
+    @received_at.setter
+    def received_at(self, val):
+        self._engine._set_times(self._engine.received_at, [self._index],
+                                _to_float(val))
+
+    @property
+    def passed_previous_intersection_at(self):
+        return _from_array(
+            self._engine.passed_previous_intersection_at[self._index])
+
+
+class _Grid:
+    """Uniform grid over vehicle positions stored as sorted cell keys."""
+
+    def __init__(self, x, y, cell_size):
+        self.cell_size = cell_size
+        keys = _cell_keys(x, y, cell_size)
+        self.order = np.argsort(keys, kind='stable')
+        self.sorted_keys = keys[self.order]
+
+    def candidates(self, x, y):
+        """Gets indices of vehicles in the 3x3 block of cells around x, y."""
+
+        key = _cell_keys(np.array([x]), np.array([y]), self.cell_size)[0]
+        targets = key + _neighbor_cell_offsets()
+        lo = np.searchsorted(self.sorted_keys, targets, side='left')
+        hi = np.searchsorted(self.sorted_keys, targets, side='right')
+
+        return np.concatenate([self.order[a:b] for a, b in zip(lo, hi)])
+
+
+def _cell_keys(x, y, cell_size):
+    c_x = np.floor(x / cell_size).astype(np.int64)
+    c_y = np.floor(y / cell_size).astype(np.int64)
+
+    return c_x * _CELL_KEY_STRIDE + c_y
+
+
+def _neighbor_cell_offsets():
+    return np.array([d_x * _CELL_KEY_STRIDE + d_y
+                     for d_x in (-1, 0, 1) for d_y in (-1, 0, 1)],
+                    dtype=np.int64)
+
+
+def pairs_within(x, y, radius, sources=None):
+    """Finds all ordered pairs of distinct points closer than radius.
+
+    Points are bucketed into square cells of one radius, and each point
+    is only compared to the points of the nine cells around it.
+
+    :param x: array of x positions
+    :param y: array of y positions
+    :param radius: maximum (exclusive) distance between pair members
+    :param sources: indices allowed as first pair member (default all)
+    :return: tuple of arrays (first index, second index, distance)
+    """
+
+    if sources is None:
+        sources = np.arange(len(x))
+
+    grid = _Grid(x, y, radius)
+    keys = _cell_keys(x[sources], y[sources], radius)
+    all_i = []
+    all_j = []
+
+    for offset in _neighbor_cell_offsets():
+        lo = np.searchsorted(grid.sorted_keys, keys + offset, side='left')
+        hi = np.searchsorted(grid.sorted_keys, keys + offset, side='right')
+        counts = hi - lo
+        total = int(counts.sum())
+
+        if total == 0:
+            continue
+
+        i = np.repeat(sources, counts)
+        within = np.arange(total) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+        all_i.append(i)
+        all_j.append(grid.order[np.repeat(lo, counts) + within])
+
+    if not all_i:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([])
+
+    i = np.concatenate(all_i)
+    j = np.concatenate(all_j)
+    dist = np.sqrt((x[j] - x[i]) ** 2 + (y[j] - y[i]) ** 2)
+    keep = (i != j) & (dist < radius)
+
+    return i[keep], j[keep], dist[keep]
+
+
+def _to_float(val):
+    return np.nan if val is None else val
+
+
+def _to_array(vals):
+    return np.array([_to_float(v) for v in vals], dtype=float)
+
+
+def _from_array(val):
+    return None if np.isnan(val) else float(val)
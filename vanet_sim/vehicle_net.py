@@ -6,10 +6,18 @@ import csv
 import math
 
 from vanet_sim import road_net
+from vanet_sim.spatial_index import SpatialGrid
 from vanet_sim.routing.routing_protocols import Message
 
 
 class Vehicle:
+    __slots__ = ('id', 'route', 'route_road_index', 'route_index',
+                 '_cur_road', 'spd', 'cur_pos', 'at_intersection',
+                 'is_cur_fwdr', 'x', 'y', 'prev_time', 'neighbors',
+                 'congestion_detected', 'metrics', '_affected_at',
+                 '_received_at', 'passed_previous_intersection_at',
+                 'dest_intersection', 'msg')
+
     def __init__(self, node_id, route):
         """Custom constructor for Vehicle.
 
@@ -19,6 +27,7 @@ class Vehicle:
 
         self.id = node_id
         self.route = route
+        self.route_road_index = _index_route(route)
 
         self.route_index = 0
         self._cur_road = None
@@ -34,16 +43,16 @@ class Vehicle:
 
         self.congestion_detected = False
 
-        self.affected_at = None
-        self.received_at = None
-        self.passed_previous_intersection_at = None
+        # EvaluationCounters to notify when affected_at or received_at
+        # change (see EvaluationCounters.track)
+        self.metrics = None
 
-        self._received_before_affected = False  # Received msg before affected
-        self._affected_not_received = False  # Affected without receiving msg
-        self._received_early = False  # Received msg & not affected
-        self._original_forwarder = False  # If msg originated from itself
+        self._affected_at = None
+        self._received_at = None
+        self.passed_previous_intersection_at = None
 
         self.set_cur_road(self.route[self.route_index], 0)
+        self.cur_road.add_vehicle(self)
 
         self.update_location(0)
 
@@ -64,10 +73,14 @@ class Vehicle:
 
         d_pos = (time - self.prev_time) * self.spd
         fwd_n = self._get_forward_neighbor()
+        prev_road = self.cur_road
+        prev_pos = self.cur_pos
 
         if self.affected_at is not None:
             return
-        elif fwd_n is not None and d_pos > _calc_distance(self, fwd_n) - 16 and time > 5:
+        elif (fwd_n is not None
+                and d_pos > _calc_distance(self, fwd_n) - road_net.FOLLOWING_DISTANCE
+                and time > 5):
             d_pos *= 0.5
 
             if self.cur_road.is_obstructed or fwd_n.affected_at is not None:
@@ -86,6 +99,43 @@ class Vehicle:
 
         self.cur_pos += d_pos
 
+        if self.cur_road is not prev_road or self.cur_pos != prev_pos:
+            prev_road.remove_vehicle(self, prev_pos)
+            self.cur_road.add_vehicle(self)
+
+        self._update_coordinates()
+        self.prev_time = time
+
+    def move_freely(self, times):
+        """Moves vehicle along its road as update_location would.
+
+        Only valid while the vehicle has no forward neighbor and does
+        not reach the obstruction or the end of its road (see
+        steps_without_interaction), so that it just moves at its
+        current speed. The position is advanced one time at a time, so
+        it is exactly the same as after calling update_location for
+        each of them.
+
+        :param times: simulation times of the skipped steps, in order
+        :return: None
+        """
+
+        if self.affected_at is not None or not times:
+            return
+
+        prev_pos = self.cur_pos
+
+        for time in times:
+            self.cur_pos += (time - self.prev_time) * self.spd
+            self.prev_time = time
+
+        if self.cur_pos != prev_pos:
+            self.cur_road.remove_vehicle(self, prev_pos)
+            self.cur_road.add_vehicle(self)
+
+        self._update_coordinates()
+
+    def _update_coordinates(self):
         self.at_intersection = self.cur_pos <= road_net.INTERSECTION_RADIUS * 3
 
         # Absolute positioning helps for determining neighbors and
@@ -98,8 +148,6 @@ class Vehicle:
         self.y = (self.cur_road.start_node.y_pos
                   + (y_range * self.cur_pos / self.cur_road.length))
 
-        self.prev_time = time
-
     def _next_road(self, time):
         """Moves vehicle to next road in route.
 
@@ -116,19 +164,41 @@ class Vehicle:
     def _get_forward_neighbor(self):
         """Gets the vehicle immediately in front of the current node.
 
+        A vehicle is in front if it is further along the same road, or
+        behind our position on another road (e.g. just past the
+        intersection we are heading to). Candidates are looked up in the
+        per-road position index rather than in the neighbor list.
+
         :return: Vehicle immediately in front of the current node
         """
 
         forward_neighbor = None
+        forward_distance = None
+
+        # Vehicles ahead on the current road
+        candidates = self.cur_road.vehicles_between(
+            self.cur_pos, self.cur_pos + road_net.FOLLOWING_DISTANCE)
 
-        for n in self.neighbors:
-            on_current_road_and_ahead = self.cur_road == n.cur_road and self.cur_pos < n.cur_pos
-            on_different_roads_and_ahead = self.cur_road != n.cur_road and self.cur_pos > n.cur_pos
-            is_ahead = on_current_road_and_ahead or on_different_roads_and_ahead
-            if (is_ahead and _calc_distance(self, n) < 16
+        # Vehicles on other roads near us and behind our position
+        for r, lo, hi in self.cur_road.nearby_roads:
+            if not lo < self.cur_pos < hi:
+                continue
+
+            proj = r.project(self.x, self.y)
+            candidates += r.vehicles_between(
+                proj - road_net.FOLLOWING_DISTANCE,
+                min(proj + road_net.FOLLOWING_DISTANCE, self.cur_pos))
+
+        for n in candidates:
+            dist = _calc_distance(self, n)
+
+            if (dist < road_net.FOLLOWING_DISTANCE
                     and (forward_neighbor is None
-                         or _calc_distance(self, forward_neighbor) > _calc_distance(self, n))):
+                         or dist < forward_distance
+                         or (dist == forward_distance
+                             and n.id < forward_neighbor.id))):
                 forward_neighbor = n
+                forward_distance = dist
 
         return forward_neighbor
 
@@ -136,7 +206,8 @@ class Vehicle:
         """ Updates the list of neighbors that the vehicle sees.
 
         :param communication_radius:
-        :param vehicle_net: the vehicle network
+        :param vehicle_net: the vehicle network, or any subset of it
+            containing every vehicle in range (see SpatialGrid)
         :return: None
         """
 
@@ -158,41 +229,51 @@ class Vehicle:
                                dst_isect=self.cur_road.start_node)
             self.received_at = time
 
+    @property
+    def affected_at(self):
+        return self._affected_at
+
+    @affected_at.setter
+    def affected_at(self, val):
+        if self.metrics is not None:
+            self.metrics.remove(self)
+            self._affected_at = val
+            self.metrics.add(self)
+        else:
+            self._affected_at = val
+
+    @property
+    def received_at(self):
+        return self._received_at
+
+    @received_at.setter
+    def received_at(self, val):
+        if self.metrics is not None:
+            self.metrics.remove(self)
+            self._received_at = val
+            self.metrics.add(self)
+        else:
+            self._received_at = val
+
     @property
     def received_before_affected(self):
         return (self.affected_at is not None and self.received_at is not None
                 and self.affected_at > self.received_at)
 
-    @received_before_affected.setter
-    def received_before_affected(self, val):
-        self._received_before_affected = val
-
     @property
     def received_early(self):
         return self.received_at is not None and self.affected_at is None
 
-    @received_early.setter
-    def received_early(self, val):
-        self._received_early = val
-
     @property
     def affected_not_received(self):
         return self.affected_at is not None and self.received_at is None
 
-    @affected_not_received.setter
-    def affected_not_received(self, val):
-        self._affected_not_received = val
-
     @property
     def original_forwarder(self):
         return (self.received_at is not None
                 and self.affected_at is not None
                 and self.received_at == self.affected_at)
 
-    @original_forwarder.setter
-    def original_forwarder(self, val):
-        self._original_forwarder = val
-
     @property
     def cur_road(self):
         return self._cur_road
@@ -209,11 +290,7 @@ class Vehicle:
         :return: if the route contains specified road
         """
 
-        for rd in self.route:
-            if rd.name is road.name:
-                return True
-
-        return False
+        return road.name in self.route_road_index
 
 
 def build_vehicle_net(filepath, road_map):
@@ -240,6 +317,81 @@ def build_vehicle_net(filepath, road_map):
     return ret_list
 
 
+def _index_route(route):
+    """Maps each road name in a route to its first position in the route.
+
+    :param route: List of Roads
+    :return: dict of road name to route index
+    """
+
+    ret_dict = {}
+
+    for i, rd in enumerate(route):
+        if rd.name not in ret_dict:
+            ret_dict[rd.name] = i
+
+    return ret_dict
+
+
+def steps_without_interaction(vehicle_net, d_time, max_steps):
+    """Counts the coming steps in which every vehicle moves freely.
+
+    A moving vehicle moves freely as long as it stays on its road, short
+    of the obstruction, and no other vehicle comes within the following
+    distance of it (so it cannot have or be a forward neighbor). Every
+    vehicle then moves at its current speed, so those steps can be
+    skipped with Vehicle.move_freely. The bounds keep one step of
+    margin, so that rounding cannot make a skipped step interact.
+
+    :param vehicle_net: List of Vehicle objects
+    :param d_time: simulation time resolution
+    :param max_steps: maximum number of steps to look ahead
+    :return: number of steps (0 when the next one may interact)
+    """
+
+    num_steps = max_steps
+    max_spd = 0
+
+    for v in vehicle_net:
+        if v.affected_at is not None or not v.spd:
+            continue
+
+        limit = v.cur_road.length
+        if v.cur_road.is_obstructed:
+            limit = min(limit, v.cur_road.obstruction_pos)
+
+        num_steps = min(num_steps,
+                        math.floor((limit - v.cur_pos) / (v.spd * d_time)) - 1)
+        if num_steps <= 0:
+            return 0
+
+        max_spd = max(max_spd, v.spd)
+
+    if not max_spd:
+        # Nothing moves anymore
+        return num_steps
+
+    # Vehicles further apart than this cannot get close enough in time
+    grid = SpatialGrid(vehicle_net, road_net.FOLLOWING_DISTANCE
+                       + 2 * max_spd * (num_steps + 1) * d_time)
+
+    for v in vehicle_net:
+        for n in grid.candidates(v):
+            # Stopped vehicles have a speed of 0
+            spd = v.spd + n.spd
+            if n is v or not spd:
+                continue
+
+            dist = _calc_distance(v, n)
+            num_steps = min(num_steps,
+                            math.floor((dist - road_net.FOLLOWING_DISTANCE)
+                                       / (spd * d_time)) - 1)
+            if num_steps <= 0:
+                return 0
+
+    return num_steps
+
+
 def _calc_distance(v0, v1):
     """Calculates the distance between two vehicles.
 